@@ -5,4 +5,5 @@ from .clover import Clover
 from .mmseqs2 import MMseqs2
 from .starcode import Starcode
 from .lsh import LSH
-from .baseclustering import BaseClustering
\ No newline at end of file
+from .baseclustering import BaseClustering
+from .consensusclustering import ConsensusClustering
\ No newline at end of file
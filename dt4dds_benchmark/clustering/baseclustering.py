@@ -13,6 +13,8 @@ logger.setLevel(logging.DEBUG)
 class BaseClustering(Step):
     """ Abstract class for clustering. To be overridden by actual clustering implementations as a subclass. """
 
+    streams_input = True    # all clustering scripts read the reads once
+
     def __post_init__(self):
         super().__post_init__()
         self._class = 'Clustering'
@@ -28,7 +30,7 @@ class BaseClustering(Step):
         start = time.time()
 
         try:
-            process = self._run_clustering(pathlib.Path(input_file), pathlib.Path(output_file), **kwargs)
+            process = self._run_clustering(pathlib.Path(input_file), pathlib.Path(output_file), **{**self.resource_limits, **kwargs})
             return process.metadata
         except Exception as e:
             logger.error(f"Clustering failed with {e}")
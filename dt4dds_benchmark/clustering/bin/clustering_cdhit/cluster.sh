@@ -2,11 +2,19 @@
 set -e
 BASE_PATH="$(dirname -- "${BASH_SOURCE[0]}")"
 
+# options after "--" are passed on to the conversion of the clusters into consensus sequences
+CLUSTER_ARGS=()
+CONSENSUS_ARGS=()
+for ((i=3; i<=$#; i++)); do
+    if [ "${!i}" == "--" ]; then CONSENSUS_ARGS=("${@:i+1}"); break; fi
+    CLUSTER_ARGS+=("${!i}")
+done
+
 # convert txt file to fasta file
 awk '{print ">"NR"\n"$0}' "$1" > "$1".fasta
 
 # run clustering
-"$BASE_PATH"/code/cd-hit-est -i "$1".fasta -o "$2".fasta -sf 1 -bak 1  "${@:3}"
+"$BASE_PATH"/code/cd-hit-est -i "$1".fasta -o "$2".fasta -sf 1 -bak 1  "${CLUSTER_ARGS[@]}"
 
 # parse clusters
 python "$BASE_PATH"/parse_clusters.py "$1".fasta "$2".fasta.bak.clstr "$2".clusters
@@ -16,7 +24,7 @@ rm -f "$2".fasta.clstr
 rm -f "$2".fasta.bak.clstr
 
 # convert clusters to consensus sequences
-"$BASE_PATH"/../tool_kalign/cluster2consensus.sh "$2".clusters "$2"
+"$BASE_PATH"/../tool_kalign/cluster2consensus.sh "$2".clusters "$2" "${CONSENSUS_ARGS[@]}"
 rm -f "$2".clusters
 
 exit
\ No newline at end of file
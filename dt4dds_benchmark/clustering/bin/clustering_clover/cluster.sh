@@ -2,6 +2,14 @@
 set -e
 BASE_PATH="$(dirname -- "${BASH_SOURCE[0]}")"
 
+# options after "--" are passed on to the conversion of the clusters into consensus sequences
+CLUSTER_ARGS=()
+CONSENSUS_ARGS=()
+for ((i=3; i<=$#; i++)); do
+    if [ "${!i}" == "--" ]; then CONSENSUS_ARGS=("${@:i+1}"); break; fi
+    CLUSTER_ARGS+=("${!i}")
+done
+
 # convert txt file to fasta file
 awk '{print ">"NR"\n"$0}' "$1" > "$1".fasta
 
@@ -11,7 +19,7 @@ rm -f "$1".fasta
 
 # run clustering
 source "$BASE_PATH"/venv/bin/activate
-python -m clover.main -I "$1".input -O "$2".output -P 0 --no-tag "${@:3}"
+python -m clover.main -I "$1".input -O "$2".output -P 0 --no-tag "${CLUSTER_ARGS[@]}"
 
 # parse clusters
 python "$BASE_PATH"/parse_clusters.py "$1".input "$2".output.txt "$2".clusters
@@ -19,7 +27,7 @@ rm -f "$1".input
 rm -f "$2".output.txt
 
 # convert clusters to consensus sequences
-"$BASE_PATH"/../tool_kalign/cluster2consensus.sh "$2".clusters "$2"
+"$BASE_PATH"/../tool_kalign/cluster2consensus.sh "$2".clusters "$2" "${CONSENSUS_ARGS[@]}"
 rm -f "$2".clusters
 
 exit
\ No newline at end of file
@@ -2,11 +2,19 @@
 set -e
 BASE_PATH="$(dirname -- "${BASH_SOURCE[0]}")"
 
+# options after "--" are passed on to the conversion of the clusters into consensus sequences
+CLUSTER_ARGS=()
+CONSENSUS_ARGS=()
+for ((i=3; i<=$#; i++)); do
+    if [ "${!i}" == "--" ]; then CONSENSUS_ARGS=("${@:i+1}"); break; fi
+    CLUSTER_ARGS+=("${!i}")
+done
+
 # run clustering
-python "$BASE_PATH"/clustering.py "$1" "$2".clusters
+python "$BASE_PATH"/clustering.py "$1" "$2".clusters "${CLUSTER_ARGS[@]}"
 
 # convert clusters to consensus sequences
-"$BASE_PATH"/../tool_kalign/cluster2consensus.sh "$2".clusters "$2"
+"$BASE_PATH"/../tool_kalign/cluster2consensus.sh "$2".clusters "$2" "${CONSENSUS_ARGS[@]}"
 rm -f "$2".clusters
 
 exit
\ No newline at end of file
@@ -1,196 +1,212 @@
+import argparse
+import contextlib
+import multiprocessing
+import operator
 import time
 import sys
-import itertools
 import numpy as np
-from skbio.alignment import local_pairwise_align_ssw
-from skbio import DNA
-
-
-#===== assign numbers to shingles of each sequence=====#
-def kmerDNA(seq,k=3):
-    kmer = []
-    for ell in range(len(seq)-k+1):
-        nstr = seq[ell:ell+k]
-        index = 0
-        for j,c in enumerate(nstr):
-            if c == 'A':
-                i = 0
-            elif c == 'C':
-                i = 1
-            elif c == 'G':
-                i = 2
-            elif c == 'T':
-                i = 3
-            else:
-                index = -1
-                break
-            index += i*(4**j)
-        kmer += [index]
-    return kmer
+from skbio.alignment import StripedSmithWaterman
+
+
+CODES = np.full(256, 4, dtype=np.uint8)     # 2-bit codes of the bases, 4 for all other characters
+CODES[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4)
+PREFIX_LENGTH = 40                          # only the prefix of each read is used for the signatures
+BATCH_SIZE = 2**14                          # number of reads whose signatures are computed at once
+CHUNK_SIZE = 1000                           # number of clusters filtered at once by a worker process
+
+
+#===== 2-bit encoding of the reads =====#
+def encode_reads(reads, length=PREFIX_LENGTH):
+    # returns the codes of the read prefixes as uint8 matrix padded with 4, and the lengths of the prefixes
+    text = np.frombuffer('\n'.join(reads).encode() + b'\n', dtype=np.uint8)
+    lengths = np.fromiter(map(len, reads), dtype=np.int64, count=len(reads))
+    starts = np.cumsum(lengths + 1) - lengths - 1
+    positions = starts[:, None] + np.arange(length)
+    lengths = np.minimum(lengths, length)
+    codes = CODES[text[np.minimum(positions, len(text) - 1)]]
+    codes[np.arange(length) >= lengths[:, None]] = 4
+    return codes, lengths
+
+
+#===== assign numbers to shingles of each sequence =====#
+def kmer_indices(codes, lengths, k=3):
+    # rolling dot product of the codes with the powers of 4, one column per k-mer position
+    n_positions = max(codes.shape[1] - k + 1, 0)
+    dtype = np.int16 if 4**k < 2**15 else np.int64
+    kmers = np.zeros((codes.shape[0], n_positions), dtype=dtype)
+    invalid = np.zeros(kmers.shape, dtype=bool)
+    for j in range(k):
+        window = codes[:, j:j+n_positions]
+        kmers += window.astype(dtype) * dtype(4**j)
+        invalid |= window > 3
+
+    # k-mers with other characters get the last index, positions beyond the end of a read get 4**k, which the tables map beyond all signatures
+    kmers[invalid] = 4**k - 1
+    kmers[np.arange(n_positions) > (lengths[:, None] - k)] = 4**k
+    return kmers
 
 #=====min-hash object=====#
 class minhashsig():
     # min-hash of k-mers
     def __init__(self,m,k):
-        # m is the number of signatures
-        self.tables = [np.random.permutation(4**k) for i in range(m)]
+        # m is the number of signatures, each table has an additional entry for positions beyond the end of a read
+        self.tables = np.array([np.random.permutation(4**k) for i in range(m)])
+        self.tables = np.hstack([self.tables, np.full((m, 1), 4**k)]).astype(np.int16 if 4**k < 2**15 else np.int64)
         self.k = k
-    def generate_signature(self,seq):
-        kmer = kmerDNA(seq,self.k)
-        sig = [ min([table[i] for i in kmer]) for table in self.tables]
-        return sig
-    
+    def generate_signatures(self,codes,lengths):
+        # look up all k-mers of a batch of reads in all tables at once, with one row per k-mer index
+        sigs = np.empty((len(codes), len(self.tables)), dtype=self.tables.dtype)
+        tables = np.ascontiguousarray(self.tables.T)
+        for i in range(0, len(codes), BATCH_SIZE):
+            kmers = kmer_indices(codes[i:i+BATCH_SIZE], lengths[i:i+BATCH_SIZE], self.k).astype(np.intp)
+            sigs[i:i+BATCH_SIZE] = tables[kmers].min(axis=1, initial=4**self.k)
+        return sigs
+
 #=====pair detection=====#
 def extract_similar_pairs(sigs,m,k_lsh,ell_lsh,maxsig):
     # sigs: minhash signatures
     # ell_lsh: number of LSH signatures
     # k_lsh: number of MH signatures to be concatenated
-    # we use generatrs to yield a number of pairs at a time for the sake of memory efficiency
-    
-    pairs = set([])
-    
+    # we use generators to yield the pairs of one LSH signature at a time for the sake of memory efficiency
+    # reads without any k-mer have the signature maxsig and are never paired
+    reads = np.flatnonzero((sigs < maxsig).all(axis=1)).astype(np.int32)
+    sigs = sigs[reads]
+    powers = np.array([maxsig**i for i in range(k_lsh)], dtype=np.int64)
+
     # generate ell_lsh random indices
     for ell in range(ell_lsh):
-        pair_count = 0
-        s = time.time()
         lshinds = np.random.permutation(m)[:k_lsh]
-        # generate LSh signatures
-        lshsigs = []
-        for sig in sigs:
-            lshsig = 0
-            for i,lshind in enumerate(lshinds):
-                lshsig += sig[lshind]*(maxsig**i)
-            lshsigs += [lshsig]
-        d = {}
-        for ind,sig in enumerate(lshsigs):
-            if sig in d:
-                d[sig] += [ind]
-            else:
-                d[sig] = [ind]
-        for candidates in d.values():
-            cent = set([])
-            if len(candidates) > 1:
-                for pair in itertools.combinations(candidates,2):
-                    cent.add(pair[0])
-                    if len(cent)==1:
-                        pairs.add(pair)
-                    else:
-                        break
-                        
-        yield pairs,ell
-        pair_count += len(pairs)
-        pairs = set([])
+        # generate LSH signatures and bucket the reads by them
+        lshsigs = sigs[:, lshinds].astype(np.int64) @ powers
+        _, first, inverse = np.unique(lshsigs, return_index=True, return_inverse=True)
+        # pair all reads of a bucket with its first read
+        centers = reads[first[inverse.ravel()]]
+        paired = centers != reads
+        yield centers[paired], reads[paired], ell
 
 #=====form clusters based on pairs=====#
-def center_cluster(pairs):
-    clusters = {}
-    hold = 0
-    t_counter = 0
-    ell_copy = 0
+def center_cluster(pairs,n_reads,min_size=4):
+    # star clustering: going through the pairs sorted by center and member, a pair (u,v) adds v to the cluster of u if u is a center,
+    # adds u to the cluster of v if v is a center, and makes u a center with v as first member if neither is a center yet
+    # within a round, centers and members are disjoint, which allows processing all pairs of a round at once
+    is_center = np.zeros(n_reads, dtype=bool)
+    created = []                                    # new centers of each round, in order of creation
+    n_pairs = np.zeros(n_reads, dtype=np.int64)     # number of pairs added to each cluster, including repeated ones
+    edges = np.empty(0, dtype=np.int64)             # unique center-member edges, encoded as center*n_reads + member
     pairsize = 0
-    while not hold:
-        
-        try:
-            out = next(pairs)
-            pairs_sort = list(out[0])
-            ell = out[1]
-            pairsize += len(pairs_sort)
-            pairs_sort.sort()
-            s = time.time()
-            for (u,v) in pairs_sort:
-                if u in clusters:
-                    clusters[u] += [v]
-        
-                if v in clusters:
-                    clusters[v] += [u]
-        
-                if v not in clusters and u not in clusters:
-                    clusters[u] = [v]
-    
-        except StopIteration:
-            hold = 1
-            print("clustering completed","---",pairsize,"pairs clustered")
-        if ell==ell_copy:
-            t_counter += time.time()-s
-        else:
-            print("Clustering time for LSH",ell_copy,":",t_counter,'\n')
-            t_counter = time.time()-s
-            ell_copy = ell
- 
-    return clusters
+    s = time.time()
+    for centers, members, ell in pairs:
+        pairsize += len(centers)
+        order = np.lexsort((members, centers))
+        u, v = centers[order], members[order]
+        u_is_center, v_is_center = is_center[u], is_center[v]
+
+        # a read becomes a center with its first member which is not a center, and collects this and all later members
+        candidates = ~u_is_center & ~v_is_center
+        new_centers, first = np.unique(u[candidates], return_index=True)
+        threshold = np.full(n_reads, n_reads, dtype=np.int32)
+        threshold[new_centers] = v[candidates][first]
+        to_u = u_is_center | (v >= threshold[u])
+
+        # members which are centers already collect the center of the pair
+        new_edges = np.concatenate([u[to_u].astype(np.int64)*n_reads + v[to_u], v[v_is_center].astype(np.int64)*n_reads + u[v_is_center]])
+        n_pairs += np.bincount(new_edges // n_reads, minlength=n_reads)
+        edges = np.union1d(edges, new_edges)
+        is_center[new_centers] = True
+        created.append(new_centers)
+    print("clustering completed","---",pairsize,"pairs clustered in",round(time.time()-s,2),"s")
+
+    # adding the center of each cluster to the cluster, keeping clusters with at least min_size pairs
+    created = np.concatenate(created) if created else np.empty(0, dtype=np.int32)
+    print(len(created),"number of clusters created")
+    bounds = np.searchsorted(edges // n_reads, np.stack([created, created + 1]))
+    return [ [c] + (edges[start:end] % n_reads).tolist() for c, start, end in zip(created.tolist(), *bounds) if n_pairs[c] >= min_size ]
 
 #=====LSH clustering (main function)=====#
 def lsh_cluster(seqs,m,k,k_lsh=2,ell_lsh=4):
     # This is the main function
     maxsig = 4**k
     minhash = minhashsig(m,k)
-    sigs = [minhash.generate_signature(seq[:40]) for seq in seqs]
+    sigs = minhash.generate_signatures(*encode_reads(seqs))
     pairs = extract_similar_pairs(sigs,m,k_lsh,ell_lsh,maxsig)
-    clusters = center_cluster(pairs)
+    clusters = center_cluster(pairs,len(seqs))
     return clusters
 
-#=====max matching=====# 
-def max_match(seq1,seq2):
-    # This function checks whether seq1 and seq2 are similar or not
-    # Checking all pairs within a cluster dramatically increases the time complexity, 
-    # so by default, in the next cell, we call this function to only check the pairs
+#=====max matching=====#
+def max_match(query,seq):
+    # This function checks whether seq is similar to the query, a profile of the cluster center, by counting the matches in their local alignment
+    # Checking all pairs within a cluster dramatically increases the time complexity,
+    # so by default, we call this function to only check the pairs
     # that one of their members is the cluster center
-    
-    alignment,score,start_end_positions \
-        = local_pairwise_align_ssw(DNA(seq1) , DNA(seq2) , match_score=2,mismatch_score=-3)
-    a = str(alignment[0])
-    b = str(alignment[1])
-    ctr = 0
-    for i,j in zip(a,b):
-        if i==j:
-            ctr += 1
-    return ctr
+    alignment = query(seq)
+    if not alignment.cigar:
+        return 0
+    return sum(map(operator.eq, alignment.aligned_query_sequence, alignment.aligned_target_sequence))
+
+#=====filtering of the clusters=====#
+def filter_clusters(clusters,th):
+    # clusters: list of (center, members) with the sequences of the reads
+    # returns the indices of the members with at least th matches to the center, building the profile of each center only once
+    filtered = []
+    for center, members in clusters:
+        query = StripedSmithWaterman(center, match_score=2, mismatch_score=-3, suppress_sequences=False, zero_index=True)
+        filtered.append([i for i, member in enumerate(members) if max_match(query, member) >= th])
+    return filtered
+
+def _filter_clusters(task):
+    return filter_clusters(*task)
 
 
 
-# 
+#
 # MAIN
-# 
-
-read_file = sys.argv[1]
-reads = []
-with open(read_file) as f:
-    for line in f:
-        reads.append(line.strip())
-
-k_lsh = 4
-sim = 0.5
-ell_lsh = int(1/(sim**k_lsh))
-m,k=50,5
-start = time.time()
-clusters = lsh_cluster(reads,m,k,k_lsh,ell_lsh)
-end = time.time()
-
-print("Runtime:",round(end-start,1),"s")
-print(len(clusters),"number of clusters created")
-
-# adding the center of each cluter to the cluster (also removing duplicates from each cluster)
-clusts = [ [c] + list(set(clusters[c])) for c in clusters if len(clusters[c]) > 3 ]
-
-
-th = 35 # filtering threshold
-k = len(clusts)
-s = time.time()
-fclusts = []
-for i,c in enumerate(clusts):
-    cent = reads[c[0]]
-    cc = [c[0]]
-    for e in c[1:]:
-        score = max_match(cent,reads[e])
-        if score >= th:
-            cc += [e]
-    fclusts += [cc]
-    if i%1000 == 0:
-        print("%",round(i*100/len(clusts),2),"of the clusters are filtered.")
-print("filtering time for",k,"clusters:",round(time.time()-s,2),"s")
-
-
-out_file = sys.argv[2]
-with open(out_file, 'w') as f:
-    for cluster in fclusts:
-        f.write(','.join([reads[i] for i in cluster]) + '\n')
\ No newline at end of file
+#
+
+def run(read_file, out_file, threads=1):
+
+    reads = []
+    with open(read_file) as f:
+        for line in f:
+            reads.append(line.strip())
+
+    k_lsh = 4
+    sim = 0.5
+    ell_lsh = int(1/(sim**k_lsh))
+    m,k=50,5
+    start = time.time()
+    clusts = lsh_cluster(reads,m,k,k_lsh,ell_lsh)
+    end = time.time()
+
+    print("Runtime:",round(end-start,1),"s")
+
+
+    th = 35 # filtering threshold
+    k = len(clusts)
+    s = time.time()
+    fclusts = []
+    # chunks of clusters are filtered in parallel, with the results collected in order
+    tasks = (([(reads[c[0]], [reads[e] for e in c[1:]]) for c in clusts[i:i+CHUNK_SIZE]], th) for i in range(0, len(clusts), CHUNK_SIZE))
+    with multiprocessing.Pool(threads) if threads > 1 else contextlib.nullcontext() as pool:
+        results = pool.imap(_filter_clusters, tasks) if pool else map(_filter_clusters, tasks)
+        for i, kept in enumerate(results):
+            chunk = clusts[i*CHUNK_SIZE:(i+1)*CHUNK_SIZE]
+            fclusts += [ [c[0]] + [c[1+j] for j in kept_members] for c, kept_members in zip(chunk, kept) ]
+    print("filtering time for",k,"clusters:",round(time.time()-s,2),"s")
+
+
+    with open(out_file, 'w') as f:
+        for cluster in fclusts:
+            f.write(','.join([reads[i] for i in cluster]) + '\n')
+
+
+def parse(args):
+    parser = argparse.ArgumentParser(description='Cluster reads by locality-sensitive hashing of their min-hash signatures.')
+    parser.add_argument('read_file', type=str, help='File with one read per line')
+    parser.add_argument('out_file', type=str, help='Target file for the clusters, with one comma-separated cluster per line')
+    parser.add_argument('--threads', type=int, help='Number of worker processes for filtering the clusters', default=1)
+    args = parser.parse_args(args)
+    return run(args.read_file, args.out_file, args.threads)
+
+
+if __name__ == "__main__":
+    parse(sys.argv[1:])
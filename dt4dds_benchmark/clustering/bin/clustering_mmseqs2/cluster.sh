@@ -2,11 +2,19 @@
 set -e
 BASE_PATH="$(dirname -- "${BASH_SOURCE[0]}")"
 
+# options after "--" are passed on to the conversion of the clusters into consensus sequences
+CLUSTER_ARGS=()
+CONSENSUS_ARGS=()
+for ((i=3; i<=$#; i++)); do
+    if [ "${!i}" == "--" ]; then CONSENSUS_ARGS=("${@:i+1}"); break; fi
+    CLUSTER_ARGS+=("${!i}")
+done
+
 # convert txt file to fasta file
 awk '{print ">"NR"\n"$0}' "$1" > "$1".fasta
 
 # run clustering
-"$BASE_PATH"/code/build/bin/mmseqs easy-cluster "$1".fasta "$2".output "$1"_tmp "${@:3}"
+"$BASE_PATH"/code/build/bin/mmseqs easy-cluster "$1".fasta "$2".output "$1"_tmp "${CLUSTER_ARGS[@]}"
 rm -rf "$1"_tmp
 rm -f "$2".output_all_seqs.fasta
 rm -f "$2".output_rep_seq.fasta
@@ -17,7 +25,7 @@ rm -f "$1".fasta
 rm -f "$2".output_cluster.tsv
 
 # convert clusters to consensus sequences
-"$BASE_PATH"/../tool_kalign/cluster2consensus.sh "$2".clusters "$2"
+"$BASE_PATH"/../tool_kalign/cluster2consensus.sh "$2".clusters "$2" "${CONSENSUS_ARGS[@]}"
 rm -f "$2".clusters
 
 exit
\ No newline at end of file
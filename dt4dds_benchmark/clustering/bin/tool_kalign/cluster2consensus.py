@@ -1,16 +1,35 @@
 import argparse
+import collections
+import itertools
+import multiprocessing
 import pathlib
 import io
 import sys
 import subprocess
+import numpy as np
 import Bio.SeqRecord, Bio.Seq, Bio.Align, Bio.AlignIO, Bio.motifs, Bio.SeqIO
 import time
 KALIGN_PATH = str((pathlib.Path(__file__).parent / 'code/build/src/kalign').resolve())
 MAX_SEQUENCES = 100
+CHUNK_SIZE = 1000                   # number of clusters whose consensus sequences are computed at once
+MAX_IN_FLIGHT = 2                   # number of chunks per worker process which are read ahead of writing their consensus sequences
+BATCH_SIZE = 2**12                  # number of reads aligned at once by the native engine
+MATCH, MISMATCH, GAP = 1, -1, -2    # scores of the native alignment
+BAND_MARGIN = 8                     # width of the alignment band beyond the length difference of the reads and their reference
+MAX_BAND = 32                       # reads differing more in length from their reference do not vote
+MAX_INSERTION = 4                   # number of inserted bases per position which can enter the consensus
+CODES = np.full(256, 4, dtype=np.uint8)     # 2-bit codes of the bases, 4 for all other characters
+CODES[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4)
+SYMBOLS = np.frombuffer(b'ACGTN', dtype=np.uint8)
+DELETION = len(SYMBOLS)             # vote for a deletion, after the votes for the symbols
+NEG = -2**14                        # score of cells outside of the alignment band
 
-def get_consensus(alignment):
-    """ Returns the consensus sequence of a list of sequences. """
-    motif = Bio.motifs.create([x.seq for x in alignment], alphabet="ACGT-")
+
+def get_consensus(alignment, counts):
+    """ Returns the consensus sequence of a list of aligned sequences, each counted as often as the count at the index given by its id. """
+    rows = np.array([np.frombuffer(str(x.seq).encode(), dtype=np.uint8) for x in alignment])
+    weights = np.array([counts[int(x.id)] for x in alignment], dtype=float)
+    motif = Bio.motifs.Motif(alphabet="ACGT-", counts={letter: (weights @ (rows == ord(letter))).tolist() for letter in "ACGT-"})
     return motif.consensus
 
 
@@ -27,6 +46,183 @@ def get_msa(sequences):
         print(f"Could not cluster sequences [{','.join([str(s) for s in sequences])}], stderr: {process.stderr}, stdin: {process.stdout}")
         raise
 
+
+def kalign_consensus(clusters):
+    """ Returns the consensus sequences of the clusters from the multiple sequence alignments by kalign of the MAX_SEQUENCES most common unique sequences of each cluster, weighted by the number of reads of each sequence. """
+    consensus_sequences = []
+    for sequences in clusters:
+        unique = collections.Counter(sequences).most_common(MAX_SEQUENCES)
+        if len(unique) == 1:
+            consensus_sequences.append(unique[0][0])
+            continue
+        reads, counts = zip(*unique)
+        consensus_sequences.append(str(get_consensus(get_msa(reads), counts).replace('-', '')))
+    return consensus_sequences
+
+
+#
+# native consensus engine
+#
+
+def encode(sequences, width, other, padding):
+    """ Returns the 2-bit codes of the sequences as matrix with one column per sequence, with other characters and padding mapped to the given codes, and the lengths of the sequences. """
+    codes = np.where(CODES < 4, CODES, other).astype(np.uint8)
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    text = np.frombuffer(''.join(sequences).encode(), dtype=np.uint8)
+    matrix = np.full((width, len(sequences)), padding, dtype=np.uint8)
+    matrix[np.arange(len(text)) - np.repeat(np.cumsum(lengths) - lengths, lengths), np.repeat(np.arange(len(sequences)), lengths)] = codes[text]
+    return matrix, lengths
+
+
+def align(references, reads):
+    """ Globally aligns each read to its reference within a band around the diagonal, for all reads at once. Returns the traceback directions (0: match, 1: deletion, 2: insertion) per anti-diagonal and band offset, the band width, and the codes and lengths of the reads and references. """
+    width = max(map(len, itertools.chain(references, reads))) + 1
+    refs, ref_lengths = encode(references, width, 4, 6)
+    codes, lengths = encode(reads, width, 5, 7)
+    band = int(min(np.abs(lengths - ref_lengths).max(initial=0) + BAND_MARGIN, MAX_BAND))
+    band += band % 2
+
+    # cells on anti-diagonal a with offset d between read and reference position, of which only every other offset exists per anti-diagonal
+    # the scores of the odd offsets are padded by one cell on each side, such that the neighbouring even offsets are slices
+    n_diagonals = int((lengths + ref_lengths).max(initial=0)) + 1
+    directions = np.zeros((n_diagonals, band + 1, len(reads)), dtype=np.uint8)
+    offsets = [np.arange(-band, band + 1, 2), np.arange(-band + 1, band, 2)]
+    scores = [np.full((band + 1, len(reads)), NEG, dtype=np.int16), np.full((band + 2, len(reads)), NEG, dtype=np.int16)]
+    scores[0][band // 2] = 0
+    for a in range(1, n_diagonals):
+        parity = a % 2
+        d, previous = offsets[parity], scores[parity][1:-1] if parity else scores[parity]
+        up, left = scores[1 - parity][1:len(d)+1], scores[1 - parity][:len(d)]
+        i, j = (a - d) // 2, (a + d) // 2
+
+        # other characters and padding have different codes in reads and references, and never match
+        matches = refs[np.clip(i - 1, 0, width - 1)] == codes[np.clip(j - 1, 0, width - 1)]
+        diagonal = previous + np.int16(MISMATCH)
+        diagonal += matches
+        diagonal += matches
+        best = np.maximum(up, left)
+        best += np.int16(GAP)
+        np.maximum(diagonal, best, out=best)
+
+        # ties prefer matches over deletions over insertions
+        not_diagonal = diagonal != best
+        directions[a, :len(d)] = not_diagonal
+        directions[a, :len(d)] += not_diagonal & (up + np.int16(GAP) != best)
+        if a <= band:
+            best[(i < 0) | (j < 0)] = NEG
+        previous[...] = best
+
+    return directions, band, codes, lengths, ref_lengths
+
+
+def trace(directions, band, lengths, ref_lengths):
+    """ Follows the traceback of all reads whose length is within the band of their reference. Returns the reads and positions of matches (read, reference position, read position), deletions (read, reference position) and insertions (read, reference position before which the base is inserted, read position, number of bases inserted after it). """
+    reads = np.flatnonzero((np.abs(lengths - ref_lengths) <= band) & (lengths + ref_lengths > 0))
+    i, j, run = ref_lengths[reads], lengths[reads], np.zeros(len(reads), dtype=np.int64)
+    matches, deletions, insertions = [], [], []
+    while len(reads):
+        step = directions[i + j, (j - i + band) // 2, reads]
+        diagonal, up, left = step == 0, step == 1, step == 2
+        matches.append((reads[diagonal], i[diagonal] - 1, j[diagonal] - 1))
+        deletions.append((reads[up], i[up] - 1))
+        insertions.append((reads[left], i[left], j[left] - 1, run[left]))
+        i, j, run = i - (diagonal | up), j - (diagonal | left), np.where(left, run + 1, 0)
+        kept = (i > 0) | (j > 0)
+        reads, i, j, run = reads[kept], i[kept], j[kept], run[kept]
+
+    empty = [np.empty(0, dtype=np.int64)] * 4
+    return [[np.concatenate(parts) for parts in zip(empty, *events)] for events in (matches, deletions, insertions)]
+
+
+def count_votes(indices, weights, size):
+    """ Returns the total weight of the votes for each of the indices. """
+    empty = np.empty(0, dtype=np.int64)
+    return np.bincount(np.concatenate([empty, *indices]), weights=np.concatenate([empty, *weights]), minlength=size).astype(np.int64)
+
+
+def native_consensus(clusters):
+    """ Returns the consensus sequences of the clusters, by aligning the MAX_SEQUENCES most common unique sequences of a cluster to its most common sequence and taking the majority vote per position, weighted by the number of reads of each sequence. """
+    unique = [collections.Counter(sequences).most_common(MAX_SEQUENCES) for sequences in clusters]
+    references = [sequences[0][0] for sequences in unique]
+    ref_lengths = np.fromiter(map(len, references), dtype=np.int64, count=len(references))
+    cluster_of = np.repeat(np.arange(len(clusters)), [len(sequences) for sequences in unique])
+    reads = [read for sequences in unique for read, _ in sequences]
+    weights = np.array([count for sequences in unique for _, count in sequences], dtype=np.int64)
+
+    # votes per reference position for each symbol and deletions, and per insertion slot before each position and at the end for each inserted symbol,
+    # with inserted bases counted from the end of the insertion
+    positions, slots = np.cumsum(ref_lengths) - ref_lengths, np.cumsum(ref_lengths + 1) - ref_lengths - 1
+    n_positions, n_slots = int(ref_lengths.sum()), int((ref_lengths + 1).sum())
+    votes, vote_weights, inserted, inserted_weights = [], [], [], []
+    n_votes = np.zeros(len(clusters), dtype=np.int64)
+    for start in range(0, len(reads), BATCH_SIZE):
+        batch, batch_weights = cluster_of[start:start+BATCH_SIZE], weights[start:start+BATCH_SIZE]
+        directions, band, codes, lengths, batch_lengths = align([references[c] for c in batch], reads[start:start+BATCH_SIZE])
+        (m_read, m_ref, m_pos), (d_read, d_ref), (i_read, i_ref, i_pos, i_run) = trace(directions, band, lengths, batch_lengths)
+        voting = np.abs(lengths - batch_lengths) <= band
+        n_votes += np.bincount(batch[voting], weights=batch_weights[voting], minlength=len(clusters)).astype(np.int64)
+        votes.append((positions[batch[m_read]] + m_ref)*(DELETION + 1) + np.minimum(codes[m_pos, m_read], len(SYMBOLS) - 1))
+        votes.append((positions[batch[d_read]] + d_ref)*(DELETION + 1) + DELETION)
+        vote_weights.extend([batch_weights[m_read], batch_weights[d_read]])
+        counted = i_run < MAX_INSERTION
+        i_read, i_ref, i_pos, i_run = i_read[counted], i_ref[counted], i_pos[counted], i_run[counted]
+        inserted.append(((slots[batch[i_read]] + i_ref)*MAX_INSERTION + i_run)*len(SYMBOLS) + np.minimum(codes[i_pos, i_read], len(SYMBOLS) - 1))
+        inserted_weights.append(batch_weights[i_read])
+    votes = count_votes(votes, vote_weights, n_positions*(DELETION + 1)).reshape(n_positions, DELETION + 1)
+    inserted = count_votes(inserted, inserted_weights, n_slots*MAX_INSERTION*len(SYMBOLS)).reshape(n_slots, MAX_INSERTION, len(SYMBOLS))
+
+    # the majority decides on each position with ties going to the reference, and inserted bases enter if more than half of the voting reads have them
+    scores = 2*votes
+    scores[np.arange(n_positions), CODES[np.frombuffer(''.join(references).encode(), dtype=np.uint8)]] += 1
+    chosen = scores.argmax(axis=1)
+    supported = np.logical_and.accumulate(2*inserted.sum(axis=2) > np.repeat(n_votes, ref_lengths + 1)[:, None], axis=1)
+
+    # each slot contributes its inserted bases in order and the base of its position, or a line break at the end of each cluster
+    output = np.full((n_slots, MAX_INSERTION + 1), ord('\n'), dtype=np.uint8)
+    present = np.ones(output.shape, dtype=bool)
+    output[:, :-1], present[:, :-1] = SYMBOLS[inserted.argmax(axis=2)[:, ::-1]], supported[:, ::-1]
+    inner = np.ones(n_slots, dtype=bool)
+    inner[slots + ref_lengths] = False
+    output[inner, -1], present[inner, -1] = np.append(SYMBOLS, 0)[chosen], chosen != DELETION
+    return output[present].tobytes().decode().split('\n')[:-1]
+
+
+#
+# main
+#
+
+def read_clusters(cluster_file, size=CHUNK_SIZE):
+    """ Yields the clusters in the cluster file in chunks, each cluster as list of sequences. """
+    with open(cluster_file, 'r') as f:
+        while chunk := list(itertools.islice(f, size)):
+            yield [[s.strip() for s in line.strip().split(',')] for line in chunk]
+
+
+def process_chunk(clusters, mode):
+    """ Returns the consensus sequences of a chunk of clusters, and the total number of sequences in the chunk. """
+    if mode == 'native':
+        consensus_sequences = native_consensus(clusters)
+    else:
+        consensus_sequences = kalign_consensus(clusters)
+    return consensus_sequences, sum(map(len, clusters))
+
+
+def process_chunks(chunks, mode, threads=1):
+    """ Yields the results of process_chunk() for the chunks in order. With several threads, the chunks are processed by a pool of worker processes, with at most MAX_IN_FLIGHT chunks per worker read ahead. """
+    if threads <= 1:
+        yield from (process_chunk(clusters, mode) for clusters in chunks)
+        return
+
+    with multiprocessing.Pool(threads) as pool:
+        pending = collections.deque()
+        for clusters in chunks:
+            pending.append(pool.apply_async(process_chunk, (clusters, mode)))
+            if len(pending) >= MAX_IN_FLIGHT*threads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
 def main(args):
     # check for files
     cluster_file = pathlib.Path(args.cluster_file)
@@ -35,22 +231,15 @@ def main(args):
     output_file = pathlib.Path(args.output_file)
     if output_file.exists():
         raise FileExistsError(f"Output file at {args.output_file} already exists.")
-    
-    # read cluster file, get consensus sequences and write to file
+
+    # stream the cluster file in chunks, get consensus sequences and write them to file in the order of the clusters
     n_clusters, n_seqs = 0, 0
-    with open(cluster_file, 'r') as fi, open(output_file, 'w') as fo:
-        for line in fi.readlines():
-            n_clusters += 1
-            if n_clusters % 1000 == 0:
-                print(f"Processed {n_clusters} clusters.", flush=True)
-            sequences = [s.strip() for s in line.strip().split(',')]
-            n_seqs += len(sequences)
-            if len(sequences) > 1:
-                aln = get_msa(sequences[:MAX_SEQUENCES])
-                consensus = get_consensus(aln).replace('-', '')
-            else:
-                consensus = sequences[0]
-            fo.write(f"{consensus}\n")
+    with open(output_file, 'w') as fo:
+        for consensus_sequences, n_chunk_seqs in process_chunks(read_clusters(cluster_file), args.mode, args.threads):
+            n_clusters += len(consensus_sequences)
+            n_seqs += n_chunk_seqs
+            fo.writelines(f"{consensus}\n" for consensus in consensus_sequences)
+            print(f"Processed {n_clusters} clusters.", flush=True)
 
     print(f"Done. Wrote {n_clusters} consensus sequences from {n_seqs} individual sequences to {output_file}.")
 
@@ -60,6 +249,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Get consensus sequences from cluster output.')
     parser.add_argument('cluster_file', type=str, help='Cluster file to process')
     parser.add_argument('output_file', type=str, help='Output file to write')
+    parser.add_argument('--mode', type=str, choices=['native', 'kalign'], help='Align the reads of each cluster by multiple sequence alignment with kalign, or to its most common read in-process', default='kalign')
+    parser.add_argument('--threads', type=int, help='Number of worker processes computing the consensus sequences', default=1)
 
     args = parser.parse_args()
 
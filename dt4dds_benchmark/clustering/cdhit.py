@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseclustering import BaseClustering
-from ..tools import SubProcess
+from .consensusclustering import ConsensusClustering
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,7 +9,7 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class CDHit(BaseClustering):
+class CDHit(ConsensusClustering):
     """
     After initialization, the clustering can be started by calling run().    
     """
@@ -20,6 +19,8 @@ class CDHit(BaseClustering):
     word_size: int = None
     threads: int = 1
 
+    execution_options = ConsensusClustering.execution_options + ('threads',)
+
 
     # 
     # defaults
@@ -49,4 +50,4 @@ class CDHit(BaseClustering):
         if self.word_size: cmd.extend(['-n', str(self.word_size)])
         if self.threads > 1: cmd.extend(['-T', str(self.threads)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
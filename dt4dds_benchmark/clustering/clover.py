@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseclustering import BaseClustering
-from ..tools import SubProcess
+from .consensusclustering import ConsensusClustering
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,7 +9,7 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class Clover(BaseClustering):
+class Clover(ConsensusClustering):
     """
     After initialization, the clustering can be started by calling run().    
     """
@@ -40,4 +39,4 @@ class Clover(BaseClustering):
         if self.vertical_drift: cmd.extend(['-V', str(self.vertical_drift)])
         if self.horizontal_drift: cmd.extend(['-H', str(self.horizontal_drift)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
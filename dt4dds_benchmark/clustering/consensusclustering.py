@@ -0,0 +1,31 @@
+import dataclasses
+
+from .baseclustering import BaseClustering
+from ..tools import SubProcess
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+@dataclasses.dataclass
+class ConsensusClustering(BaseClustering):
+    """ Abstract class for clusterings whose script converts the clusters into consensus sequences with cluster2consensus. """
+
+    consensus_mode: str = 'kalign'  # 'kalign' computes a multiple sequence alignment with kalign per cluster, 'native' aligns the reads of each cluster to its most common read in-process
+    consensus_threads: int = 1      # number of worker processes computing the consensus sequences
+
+    execution_options = BaseClustering.execution_options + ('consensus_threads',)
+
+    @property
+    def consensus_options(self):
+        """ Returns the options for the conversion of the clusters into consensus sequences. """
+        options = []
+        if self.consensus_mode != 'kalign': options.extend(['--mode', self.consensus_mode])
+        if self.consensus_threads > 1: options.extend(['--threads', str(self.consensus_threads)])
+        return options
+
+
+    def _run_command(self, cmd: list, **kwargs):
+        """ Runs the command of the clustering, passing the options for the consensus sequences after the clustering options. """
+        return SubProcess(cmd + (['--', *self.consensus_options] if self.consensus_options else []), **kwargs)
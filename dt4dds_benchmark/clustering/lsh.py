@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseclustering import BaseClustering
-from ..tools import SubProcess
+from .consensusclustering import ConsensusClustering
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,12 +9,15 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class LSH(BaseClustering):
+class LSH(ConsensusClustering):
     """
     After initialization, the clustering can be started by calling run().    
     """
     
     command_path = str(pathlib.Path(__file__).parent.absolute() / 'bin' / 'clustering_lsh' / 'cluster.sh')
+    threads: int = 1
+
+    execution_options = ConsensusClustering.execution_options + ('threads',)
 
 
     # 
@@ -30,4 +32,7 @@ class LSH(BaseClustering):
         cmd.append(str(input_file.resolve()))
         cmd.append(str(output_file.resolve()))
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        # add optional arguments
+        if self.threads > 1: cmd.extend(['--threads', str(self.threads)])
+
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
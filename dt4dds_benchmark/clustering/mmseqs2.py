@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseclustering import BaseClustering
-from ..tools import SubProcess
+from .consensusclustering import ConsensusClustering
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,7 +9,7 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class MMseqs2(BaseClustering):
+class MMseqs2(ConsensusClustering):
     """
     After initialization, the clustering can be started by calling run().    
     """
@@ -38,4 +37,4 @@ class MMseqs2(BaseClustering):
         if self.minimum_identity: cmd.extend(['--min-seq-id', str(self.minimum_identity)])
         if self.coverage_mode: cmd.extend(['--cov-mode', str(self.coverage_mode)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseclustering import BaseClustering
-from ..tools import SubProcess
+from .consensusclustering import ConsensusClustering
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,7 +9,7 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class Starcode(BaseClustering):
+class Starcode(ConsensusClustering):
     """
     After initialization, the clustering can be started by calling run().    
     """
@@ -22,6 +21,8 @@ class Starcode(BaseClustering):
     connected_comp: bool = False
     threads: int = 1
 
+    execution_options = ConsensusClustering.execution_options + ('threads',)
+
 
     # 
     # clustering
@@ -42,4 +43,4 @@ class Starcode(BaseClustering):
         if self.connected_comp: cmd.append('--connected-comp')
         if self.threads > 1: cmd.extend(['--threads', str(self.threads)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
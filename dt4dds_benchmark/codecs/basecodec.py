@@ -31,7 +31,7 @@ class BaseCodec(Step):
         start = time.time()
 
         try:
-            process = self._run_encoding(pathlib.Path(input_file), pathlib.Path(sequence_file), **kwargs)
+            process = self._run_encoding(pathlib.Path(input_file), pathlib.Path(sequence_file), **{**self.resource_limits, **kwargs})
             return process.metadata
         except Exception as e:
             logger.error(f"Encoding failed with {e}")
@@ -52,7 +52,7 @@ class BaseCodec(Step):
         start = time.time()
 
         try:
-            process = self._run_decoding(pathlib.Path(sequence_file), pathlib.Path(output_file), **kwargs)
+            process = self._run_decoding(pathlib.Path(sequence_file), pathlib.Path(output_file), **{**self.resource_limits, **kwargs})
             return process.metadata
         except Exception as e:
             logger.exception(f"Decoding failed with {e}")
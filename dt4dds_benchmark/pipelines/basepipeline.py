@@ -1,3 +1,4 @@
+import os
 import time
 import tempfile
 import pathlib
@@ -5,15 +6,22 @@ import shutil
 import dataclasses
 import copy
 import itertools
+import math
+import concurrent.futures
 from typing import List, Dict
 
-from ..tools import logs, standardize_dict
+from ..tools import logs, standardize_dict, dict_digest, Step, StepCache
 
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+DEFAULT_SCRATCH_DIR = pathlib.Path('/dev/shm')     # RAM disk used as scratch directory if it has enough free space
+SCRATCH_PREFIX = 'dt4dds_'                          # prefix of the temporary working folders, used to count the pipelines working in a scratch directory
+SCRATCH_FULL_BYTES = 2**26                          # free space in bytes below which a failed step is attributed to a full scratch directory
+EXECUTION_OPTIONS = ['output_folder', 'delete_output_folder', 'cache_folder', 'cache_steps', 'stream_steps', 'scratch_dir', 'scratch_min_free_gb', 'keep_files', 'compare_by_digest']   # settings that only change how a pipeline is run, not its results
+
 
 @dataclasses.dataclass(kw_only=True)
 class BasePipeline():
@@ -25,6 +33,13 @@ class BasePipeline():
     delete_output_folder: bool = False      # whether to delete the output folder after running the pipeline
     process_timeout: int = 1*60*60          # timeout for each process in seconds
     metadata: dict = None                   # additional metadata about the pipeline
+    cache_folder: pathlib.Path = ''         # path to the folder for caching step outputs across pipelines, if empty, no caching is done
+    cache_steps: list = dataclasses.field(default_factory=lambda: ['encoding'])   # identifiers of the steps whose outputs are cached
+    stream_steps: bool = False              # run consecutive steps concurrently if they support it, passing the data through named pipes instead of files
+    scratch_dir: pathlib.Path = None        # folder in which the pipeline works, if None, /dev/shm is used if it has room, if empty, the pipeline works in the output folder
+    scratch_min_free_gb: float = 2          # free space in GB required per running pipeline to use /dev/shm as scratch directory by default
+    keep_files: list = None                 # glob patterns of the files copied from the scratch directory to the output folder, if None, the logs, the settings and the output of the last step
+    compare_by_digest: bool = False         # compare the decoded output with the input file via the cached digest of the input file, faster if many pipelines share an input file but without reporting where the files differ
 
     # file names
     filename_input: str = 'input'                   # name of the file to be encoded
@@ -37,16 +52,17 @@ class BasePipeline():
     filename_suffix_params: str = '_settings.yaml'  # suffix for parameter files
 
     # generated file paths
-    filepath_input = property(lambda self: self.output_folder.resolve() / self.filename_input)
-    filepath_sequences = property(lambda self: self.output_folder.resolve() / self.filename_sequences)
-    filepath_reads = property(lambda self: self.output_folder.resolve() / self.filename_reads)
-    filepath_clusters = property(lambda self: self.output_folder.resolve() / self.filename_clusters)
-    filepath_output = property(lambda self: self.output_folder.resolve() / self.filename_output)
-    filepath_log = property(lambda self: self.output_folder.resolve() / self.filename_log)
+    filepath_input = property(lambda self: pathlib.Path(self.output_folder).resolve() / self.filename_input)
+    filepath_sequences = property(lambda self: pathlib.Path(self.output_folder).resolve() / self.filename_sequences)
+    filepath_reads = property(lambda self: pathlib.Path(self.output_folder).resolve() / self.filename_reads)
+    filepath_clusters = property(lambda self: pathlib.Path(self.output_folder).resolve() / self.filename_clusters)
+    filepath_output = property(lambda self: pathlib.Path(self.output_folder).resolve() / self.filename_output)
+    filepath_log = property(lambda self: pathlib.Path(self.output_folder).resolve() / self.filename_log)
 
     # convenience properties
     identifier = property(lambda self: f"{self._class}:{self._type}")
     parameters = property(lambda self: standardize_dict(dataclasses.asdict(self)))
+    key = property(lambda self: dict_digest(self._key_parameters()))
 
 
     def __post_init__(self):
@@ -56,6 +72,25 @@ class BasePipeline():
 
     @classmethod
     def factory(cls, 
+            list_args: Dict[str, List], 
+            n_iterations: int = None, 
+            output_folder: pathlib.Path = None, 
+            lazy: bool = False,
+            **kwargs
+        ):
+        """ Returns a pipeline for each combination of the list arguments and each iteration. If lazy is set, returns a generator creating the pipelines on demand instead. """
+        pipelines = cls._generate(list_args, n_iterations, output_folder, **kwargs)
+        if lazy:
+            return pipelines
+
+        # return the pipeline instances
+        pipelines = list(pipelines)
+        logger.info(f"Generated {len(pipelines)} pipelines.")
+        return pipelines
+
+
+    @classmethod
+    def _generate(cls, 
             list_args: Dict[str, List], 
             n_iterations: int = None, 
             output_folder: pathlib.Path = None, 
@@ -63,10 +98,10 @@ class BasePipeline():
         ):
 
         # generate all possible combinations of the list arguments
-        combinations = list(itertools.product(*list_args.values()))
+        combinations = itertools.product(*list_args.values())
+        n_combinations = math.prod(len(values) for values in list_args.values())
 
         # create a pipeline for each combination
-        pipelines = []
         for i, combination in enumerate(combinations):
 
             # re-pack the arguments with their keyword
@@ -77,7 +112,7 @@ class BasePipeline():
 
                 # set up the output folder
                 if output_folder:
-                    title = "_".join([a.name for a in args_dict.values()]) + f"_{str(i).zfill(len(str(len(combinations))))}"
+                    title = "_".join([a.name for a in args_dict.values()]) + f"_{str(i).zfill(len(str(n_combinations)))}"
                     folder = pathlib.Path(output_folder) / title
                     if i_iter: folder = folder / str(i_iter).zfill(len(str(n_iterations)))
                 else:
@@ -97,11 +132,29 @@ class BasePipeline():
                     metadata = metadata,
                     output_folder = folder,
                 )
-                pipelines.append(cls(**ikwargs))
+                yield cls(**ikwargs)
 
-        # return the pipeline instances
-        logger.info(f"Generated {len(pipelines)} pipelines.")
-        return pipelines
+
+    @property
+    def prefix_key(self):
+        """ Hash of everything the leading cached steps depend on. Pipelines with the same prefix key share the outputs of these steps via the cache. """
+        if not self.cache_folder: return None
+        prefix = list(itertools.takewhile(lambda part: part[4] in self.cache_steps, self._pipeline))
+        if not prefix: return None
+
+        # only keep the settings that are not specific to the run or to the later steps
+        prefix_steps = [step for step, *_ in prefix]
+        later_steps = [step for step, *_ in self._pipeline[len(prefix):] if not any(step is s for s in prefix_steps)]
+        excluded = ['metadata'] + [field.name for field in dataclasses.fields(self) if any(getattr(self, field.name) is step for step in later_steps)]
+        return dict_digest({'steps': [identifier for *_, identifier in prefix], 'parameters': self._key_parameters(excluded)})
+
+
+    def _key_parameters(self, excluded: list = ()):
+        """ Returns the parameters identifying the runs of the pipeline, without the settings that only change how the pipeline and its steps are run. """
+        parameters = {key: value for key, value in self.parameters.items() if key not in EXECUTION_OPTIONS and key not in excluded}
+        for key in parameters:
+            if isinstance(step := getattr(self, key, None), Step): parameters[key] = step.key_parameters
+        return parameters
 
 
     @property
@@ -109,6 +162,21 @@ class BasePipeline():
         raise NotImplementedError
 
 
+    @property
+    def _scratch_dir(self):
+        """ Directory in which the temporary working folder of the pipeline is created, or None if the pipeline works in its output folder. """
+        if self.scratch_dir is not None:
+            return pathlib.Path(self.scratch_dir) if self.scratch_dir else None
+        try:
+            # reserve the free space for each pipeline already working in /dev/shm, as their files are still growing
+            n_running = sum(1 for _ in DEFAULT_SCRATCH_DIR.glob(f'{SCRATCH_PREFIX}*'))
+            if shutil.disk_usage(DEFAULT_SCRATCH_DIR).free >= self.scratch_min_free_gb * 1e9 * (n_running + 1):
+                return DEFAULT_SCRATCH_DIR
+        except OSError:
+            pass
+        return None
+
+
     def run(self):
         # check/prepare the output folder
         if self.output_folder:
@@ -117,11 +185,21 @@ class BasePipeline():
             if self.output_folder.exists():
                 raise FileExistsError(f'Output folder {self.output_folder} already exists.')
         else:
-            # create a temporary folder
-            self.output_folder = pathlib.Path(tempfile.mkdtemp())
+            # only a temporary folder is used
             self.delete_output_folder = True
 
-        # set up the output folder and the logger
+        # work in a temporary folder in the scratch directory, unless working in the output folder directly
+        scratch_dir = self._scratch_dir
+        output_folder = self.output_folder
+        if output_folder:
+            output_folder.mkdir(parents=True, exist_ok=True)
+        if scratch_dir or not output_folder:
+            self.output_folder = pathlib.Path(tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=scratch_dir))
+
+        # folder on disk to move to if the scratch directory runs out of space, None for the default temporary directory, False if not working in scratch
+        self._spill_folder = (output_folder or None) if scratch_dir else False
+
+        # set up the working folder and the logger
         self.output_folder.mkdir(parents=True, exist_ok=True)
         logs.setup_logfile(self.filepath_log, level=logger.level)
 
@@ -146,23 +224,109 @@ class BasePipeline():
             # de-register the logger file handler
             logs.remove_logfile(self.filepath_log)
 
+            # copy the files to keep from the temporary folder to the output folder, then remove it
+            if self.output_folder != output_folder:
+                if output_folder and not self.delete_output_folder:
+                    self._copy_kept_files(self.output_folder, output_folder)
+                shutil.rmtree(str(self.output_folder.resolve()), ignore_errors=True)
+                self.output_folder = output_folder
+
             # remove the output folder if needed
             if self.delete_output_folder:
-                shutil.rmtree(str(self.output_folder.resolve()), ignore_errors=True)
+                if self.output_folder:
+                    shutil.rmtree(str(self.output_folder.resolve()), ignore_errors=True)
                 self.output_folder = None
 
 
+    def _copy_kept_files(self, source_folder: pathlib.Path, target_folder: pathlib.Path):
+        """ Copies the files matching the patterns of the files to keep from the source folder to the target folder. """
+        patterns = self.keep_files
+        if patterns is None:
+            patterns = [f'*{self.filename_suffix_log}', f'*{self.filename_suffix_params}', self._pipeline[-1][3].name]
+
+        target_folder.mkdir(parents=True, exist_ok=True)
+        for pattern in patterns:
+            for filepath in source_folder.glob(pattern):
+                if not filepath.is_file(): continue
+                target = target_folder / filepath.relative_to(source_folder)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(str(filepath), str(target))
+
+
     def _prepare_files(self):
         pass
+
+
+    def _scratch_full(self):
+        """ Whether the pipeline works in a scratch directory that has run out of space. """
+        if self._spill_folder is False: return False
+        try:
+            return shutil.disk_usage(self.output_folder).free < SCRATCH_FULL_BYTES
+        except OSError:
+            return False
+
+
+    def _remove_new_files(self, existing: set):
+        """ Removes the files and folders in the working folder which are not among the existing ones, i.e. the outputs, logs and side files of a failed stage. """
+        for filepath in set(self.output_folder.iterdir()) - existing:
+            if filepath.is_dir() and not filepath.is_symlink():
+                shutil.rmtree(str(filepath), ignore_errors=True)
+            else:
+                filepath.unlink(missing_ok=True)
+
+
+    def _spill(self):
+        """ Moves the working folder from the scratch directory to disk, i.e. into a temporary folder in the output folder or in the default temporary directory. """
+        folder = pathlib.Path(tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=self._spill_folder))
+        logger.warning(f"Scratch directory ran out of space, moving the working folder to {folder}.")
+        logs.remove_logfile(self.filepath_log)
+        for filepath in self.output_folder.iterdir():
+            shutil.move(str(filepath), str(folder / filepath.name))
+        shutil.rmtree(str(self.output_folder.resolve()), ignore_errors=True)
+        self.output_folder, self._spill_folder = folder, False
+        logs.setup_logfile(self.filepath_log, level=logger.level)
         
 
+    def _streams(self, producer: tuple, consumer: tuple):
+        """ Whether the output of the producer is passed to the consumer through a named pipe, which requires that both access the file only sequentially and that no other step or cache needs the file. """
+        if not self.stream_steps: return False
+        if producer[3] != consumer[2] or sum(part[2] == producer[3] for part in self._pipeline) > 1: return False
+        if self.cache_folder and (producer[4] in self.cache_steps or consumer[4] in self.cache_steps): return False
+        return producer[0].streams_output and consumer[0].streams_input
+
+
+    @property
+    def _stages(self):
+        """ Groups the parts of the pipeline into stages, whose parts are run concurrently and connected by named pipes. """
+        stages = []
+        for part in self._pipeline:
+            if stages and self._streams(stages[-1][-1], part):
+                stages[-1].append(part)
+            else:
+                stages.append([part])
+        return stages
+
+
     def _run_pipeline(self):
-        # run each part of the pipeline, tracking where it fails
+        # run each stage of the pipeline, tracking where it fails
         failed_at = ""
-        for step, process_call, input, output, identifier in self._pipeline:
-            if not self._run_step(process_call, input, output, identifier): 
-                logger.info(f"Pipeline failed at step {identifier}.")
-                failed_at = identifier
+        for i, stage in enumerate(self._stages):
+            n_performance, existing = len(self.performance), set(self.output_folder.iterdir())
+            finished = self._run_stage(stage)
+
+            # a step failing in a full scratch directory is run again on disk, with the paths of the moved working folder and without its partial outputs
+            if not all(success for _, success in finished) and self._scratch_full():
+                del self.performance[n_performance:]
+                self._remove_new_files(existing)
+                self._spill()
+                finished = self._run_stage(self._stages[i])
+
+            for identifier, success in finished:
+                if not success:
+                    failed_at = identifier
+                    break
+            if failed_at:
+                logger.info(f"Pipeline failed at step {failed_at}.")
                 break
 
         # check if the pipeline was successful
@@ -179,15 +343,71 @@ class BasePipeline():
         return self.result, self.performance
 
     
-    def _run_step(self, process_call, input: pathlib.Path, output: pathlib.Path, identifier: str):
+    def _run_stage(self, stage: list):
+        """ Runs the parts of the stage and returns their identifiers and success in the order they finished. Parts of a stage with more than one part are run concurrently, with the outputs of all but the last part replaced by named pipes. """
+        if len(stage) == 1:
+            return [(stage[0][4], self._run_step(*stage[0]))]
+
+        logger.debug(f"Streaming {' -> '.join(identifier for *_, identifier in stage)}")
+        pipes = [output for *_, output, _ in stage[:-1]]
+        for pipe in pipes:
+            os.mkfifo(pipe)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(len(stage)) as executor:
+                futures = [executor.submit(self._process_step, *part) for part in stage]
+                finished = []
+                for i, future in enumerate(futures):
+                    future.add_done_callback(lambda _, i=i: finished.append(i))
+                while pending := [future for future in futures if not future.done()]:
+                    concurrent.futures.wait(pending, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                    # a finished part never opens its pipes again, so open them in its place to release neighbours that still wait for it
+                    for i, future in enumerate(futures):
+                        if not future.done(): continue
+                        if i > 0 and not futures[i-1].done(): _release_pipe(pipes[i-1], os.O_RDONLY)
+                        if i < len(pipes) and not futures[i+1].done(): _release_pipe(pipes[i], os.O_WRONLY)
+                performances = [future.result() for future in futures]
+        finally:
+            for pipe in pipes:
+                pipe.unlink(missing_ok=True)
+
+        # the success of each part is still determined on its own, a part failing first is the cause of any broken pipes of its neighbours
+        self.performance.extend(performances)
+        return [(stage[i][4], performances[i]['success']) for i in finished]
+
+
+    def _run_step(self, step, process_call, input: pathlib.Path, output: pathlib.Path, identifier: str):
+        performance = self._process_step(step, process_call, input, output, identifier)
+
+        # save metadata
+        self.performance.append(performance)
+
+        # return success
+        return performance['success']
+
+
+    def _process_step(self, step, process_call, input: pathlib.Path, output: pathlib.Path, identifier: str):
+        # check for a cached output of this step
+        cache, cache_key, performance = None, None, None
+        if self.cache_folder and identifier in self.cache_steps:
+            cache = StepCache(self.cache_folder)
+            cache_key = cache.key(step, input)
+            performance = cache.load(cache_key, self.output_folder.resolve())
+            if performance is not None:
+                logger.info(f"Using cached output for {identifier} from cache entry {cache_key}.")
+
         # run the process
-        logger.debug(f"Running {identifier}")
-        performance = process_call(
-            input, 
-            output, 
-            process_log_file = self.output_folder / (identifier + self.filename_suffix_log),
-            timeout = self.process_timeout
-        )
+        if performance is None:
+            logger.debug(f"Running {identifier}")
+            performance = process_call(
+                input, 
+                output, 
+                process_log_file = self.output_folder / (identifier + self.filename_suffix_log),
+                timeout = self.process_timeout
+            )
+            performance['cached'] = False
+        else:
+            performance['cached'] = True
 
         # we measure success by the return code and whether the output file exists
         success = (performance['return_code'] == 0) and output.exists()
@@ -198,12 +418,21 @@ class BasePipeline():
         performance['identifier'] = identifier
         performance['success'] = success
 
-        # save metadata
-        self.performance.append(performance)
+        # store the output of a successful step in the cache, including any files required later on
+        if cache and success and not performance['cached']:
+            filenames = [output.relative_to(self.output_folder.resolve())] + list(getattr(step, 'required_files', []))
+            cache.store(cache_key, self.output_folder.resolve(), filenames, performance)
 
-        # return success
-        return performance['success']
+        return performance
 
 
     def _customize_result(self, results):
+        pass
+
+
+def _release_pipe(pipe: pathlib.Path, flags: int):
+    """ Briefly opens the named pipe without blocking, which lets a process waiting to open the other end continue and see that its partner is gone. """
+    try:
+        os.close(os.open(pipe, flags | os.O_NONBLOCK))
+    except OSError:
         pass
\ No newline at end of file
@@ -66,7 +66,7 @@ class Decoding(BasePipeline):
         # if an input file was given, check if the output file exists and is identical to the input file
         if self.input_file:
             output_exists = self.filepath_output.exists()
-            output_identical = files_are_equal(str(self.input_file), str(self.filepath_output))
+            output_identical = files_are_equal(str(self.input_file), str(self.filepath_output), use_digest=self.compare_by_digest)
             logger.warning(f"Decoding success: {output_exists and output_identical}, output file exists: {output_exists}, files are equal: {output_identical}")
             result['input_file'] = self.input_file.name
             result['decoding_success'] = output_exists and output_identical
\ No newline at end of file
@@ -1,11 +1,20 @@
+import os
+import socket
 import time
 import pathlib
+import psutil
 import pandas as pd
 import bamboost
 import numpy as np
 import h5py
 import uuid
 import time
+import concurrent.futures
+import threading
+import queue
+import heapq
+import itertools
+import collections.abc
 
 from ..analysis import Dataset
 
@@ -24,15 +33,33 @@ class BaseManager():
         self.overview = []
         self.results = []
         self.performance = []
+        self.n_pipelines = None
+        self.resume = False
 
 
-    def run(self, pipelines):
-        """  """
+    def run(self, pipelines, workers: int = 1, resume: bool = False):
+        """ Runs the pipelines one after another or, if workers > 1, in a pool of that many worker processes. If resume is set, pipelines which have already finished are skipped, otherwise pipelines with the same parameters are run again as replicates. The pipelines can be any iterable, e.g. a lazy factory, in which case they are only created once they are about to run. """
         start = time.time()
-        logger.info(f"Running {len(pipelines)} pipelines.")
+        self.resume = resume
+
+        # skip the pipelines with a finished run of the same parameters
+        if resume:
+            finished = self._get_finished_keys()
+            if isinstance(pipelines, collections.abc.Sized):
+                n_total = len(pipelines)
+                pipelines = [pipeline for pipeline in pipelines if pipeline.key not in finished]
+                if len(pipelines) < n_total:
+                    logger.info(f"Skipping {n_total - len(pipelines)} pipelines which have already finished.")
+            elif finished:
+                pipelines = (pipeline for pipeline in pipelines if pipeline.key not in finished)
+                logger.info(f"Skipping pipelines which have already finished.")
+
+        # the number of pipelines is only known up front if they are not generated lazily
+        self.n_pipelines = len(pipelines) if isinstance(pipelines, collections.abc.Sized) else None
+        logger.info(f"Running {self.n_pipelines if self.n_pipelines is not None else 'all'} pipelines with {workers} worker(s).")
 
         # run the pipelines
-        self._run(pipelines)
+        self._run(pipelines, workers=workers)
 
         # finish up
         logger.info(f"Finished running pipelines in {time.time() - start:.0f} seconds.")
@@ -62,45 +89,247 @@ class BaseManager():
         return self.get_current_data()
 
 
-    def _run(self, pipelines):
+    def _get_finished_keys(self):
+        """ Returns the keys of all pipelines which have finished. """
+        return {overview['key'] for overview in self.overview if overview['status'] == 'Finished'}
+
+
+    def _run(self, pipelines, workers=1):
         """  """
-        # iterate over the pipelines
-        for i, pipeline in enumerate(pipelines):
-            logger.info(f"Running pipeline: {pipeline} ({i+1}/{len(pipelines)})")
-            parameters, result, performance = self._run_pipeline(pipeline)
+        # iterate over the pipelines, stopping at the first failure
+        for uid, result, performance, error in self._execute(((uuid.uuid4().hex, pipeline) for pipeline in pipelines), workers=workers):
+            if error is not None:
+                raise error
 
 
-    def _run_pipeline(self, pipeline, uid=None):
+    def _progress(self, i):
+        """ Returns the progress of the i-th pipeline, including the total number of pipelines if known. """
+        return f"{i+1}/{self.n_pipelines}" if self.n_pipelines is not None else f"{i+1}"
 
-        # set the uid
-        if uid is None: uid = uuid.uuid4().hex
+
+    def _execute(self, pipelines, workers=1, on_start=None):
+        """ Runs the (uid, pipeline) pairs taken from the iterable and yields (uid, result, performance, error) for each, in the order of the pipelines. """
+        if workers > 1:
+            yield from self._execute_parallel(pipelines, workers, on_start)
+            return
+
+        for i, (uid, pipeline) in enumerate(pipelines):
+            if on_start: on_start(uid)
+            logger.info(f"Running pipeline: {pipeline} ({self._progress(i)})")
+            try:
+                overview, result, performance = self._run_pipeline(pipeline, uid=uid)
+            except Exception as e:
+                yield uid, None, None, e
+                continue
+            yield uid, result, performance, None
+
+
+    def _execute_parallel(self, pipelines, workers, on_start=None):
+        """ Runs the (uid, pipeline) pairs in a pool of worker processes, with at most as many pipelines in flight as there are workers. Pipelines are only taken from the iterable once they are needed to keep the pool saturated. """
+        pipelines = iter(pipelines)
+        queued, overviews, outcomes, pending = {}, {}, {}, {}
+        ready, followers, leaders = [], {}, {}
+        n_queued, i_yield, exhausted = 0, 0, False
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        try:
+            while not exhausted or i_yield < n_queued:
+
+                # take pipelines from the iterable until there are enough to keep the pool saturated, without holding many pipelines back behind their leaders
+                while not exhausted and len(ready) + len(pending) < workers and n_queued - i_yield < 2 * workers:
+                    try:
+                        queued[n_queued] = next(pipelines)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    self._plan(n_queued, queued[n_queued][1], ready, followers, leaders)
+                    n_queued += 1
+
+                # keep the pool saturated, without queueing more pipelines than there are workers
+                while ready and len(pending) < workers:
+                    i = heapq.heappop(ready)
+                    uid, pipeline = queued[i]
+                    try:
+                        overviews[i] = self._prepare_pipeline(pipeline, uid)
+                    except Exception as e:
+                        outcomes[i] = (None, None, e)
+                        for j in followers.pop(i, []): heapq.heappush(ready, j)
+                        continue
+                    if on_start: on_start(uid)
+                    logger.info(f"Submitting pipeline: {pipeline} ({self._progress(i)})")
+                    pending[executor.submit(pipeline.run)] = i
+
+                # collect the outcomes of finished pipelines, releasing the pipelines waiting for them
+                if i_yield not in outcomes and pending:
+                    finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        i = pending.pop(future)
+                        try:
+                            result, performance = future.result()
+                            outcomes[i] = (result, performance, None)
+                        except Exception as e:
+                            outcomes[i] = (None, None, e)
+                        for j in followers.pop(i, []): heapq.heappush(ready, j)
+
+                # record and yield the outcomes in the order of the pipelines
+                while i_yield in outcomes:
+                    result, performance, error = outcomes.pop(i_yield)
+                    overview = overviews.pop(i_yield, None)
+                    if overview is not None:
+                        self._record_pipeline(overview, result, performance, error)
+                    uid, _ = queued.pop(i_yield)
+                    yield uid, result, performance, error
+                    i_yield += 1
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+    def _plan(self, i, pipeline, ready, followers, leaders):
+        """ Adds the i-th pipeline to the pipelines which can be run right away, or to the pipelines waiting for the unfinished leader with the same prefix key. Pipelines sharing their leading cached steps wait for the first of them, such that these steps are only run once. """
+        key = pipeline.prefix_key
+        leader = leaders.get(key) if key is not None else None
+        if leader in followers:
+            followers[leader].append(i)
+            logger.debug(f"Pipeline {self._progress(i)} will re-use the shared steps of pipeline {self._progress(leader)}.")
+            return
+        if key is not None and leader is None:
+            leaders[key] = i
+            followers[i] = []
+        heapq.heappush(ready, i)
+
+
+    def _prepare_pipeline(self, pipeline, uid):
+        """ Assigns the output folder of the pipeline and returns its overview. """
+        key = pipeline.key
         if pipeline.output_folder:
             pipeline.output_folder = pathlib.Path(pipeline.output_folder) / uid
             if pipeline.output_folder.exists(): raise FileExistsError(f"Output folder {pipeline.output_folder} already exists.")
 
         # create the overview
-        overview = {'id': uid, 'status': 'Running'}
+        overview = {'id': uid, 'key': key, 'status': 'Running'}
         overview.update(bamboost.common.utilities.flatten_dict(pipeline.parameters))
+        return overview
 
-        # run the pipeline
-        try:
-            result, performance = pipeline.run()
+
+    def _record_pipeline(self, overview, result=None, performance=None, error=None):
+        """ Stores the outcome of a pipeline and updates its status in the overview. """
+        if error is None:
             self.results.append(result)
             self.performance.append(performance)
             overview.update({'status': 'Finished'})
-            return overview, result, performance
+        else:
+            overview.update({'status': f'Failed: {str(error)}'})
+            logger.error(f"Pipeline {overview['id']} failed with {error}.")
+        self.overview.append(overview)
+
+
+    def _run_pipeline(self, pipeline, uid=None):
+
+        # set the uid and create the overview
+        if uid is None: uid = uuid.uuid4().hex
+        overview = self._prepare_pipeline(pipeline, uid)
+
+        # run the pipeline
+        try:
+            result, performance = pipeline.run()
         except Exception as e:
-            overview.update({'status': f'Failed: {str(e)}'})
+            self._record_pipeline(overview, error=e)
             logger.exception(f"Pipeline {pipeline} failed with {e}.")
             raise e
-        finally:
-            self.overview.append(overview)
+        self._record_pipeline(overview, result, performance)
+        return overview, result, performance
 
         
 
+class HDF5Writer():
+    """ Collects the updates to an HDF5Manager's file in a queue and writes them from a single background thread, in one transaction per batch. """
+
+    def __init__(self, manager, flush_interval: float = 1.0):
+        self.manager = manager
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, name='HDF5Writer', daemon=True)
+        self.pending = []
+        self.dropped = []   # updates which could not be written for other reasons than the file being unavailable
+
+
+    def start(self):
+        self.thread.start()
+
+
+    def put(self, uid, attributes: dict = None, result: dict = None, performance: list = None):
+        """ Queues an update of the group of the given pipeline. """
+        self.queue.put(('update', uid, attributes, result, performance))
+
+
+    def remove(self, uids: list):
+        """ Queues the removal of the groups of the given pipelines. """
+        for uid in uids:
+            self.queue.put(('remove', uid, None, None, None))
+
+
+    def close(self):
+        """ Writes all remaining updates and stops the writer thread. """
+        self.queue.put(None)
+        self.thread.join()
+        if self.pending:
+            self._flush()
+
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            # wait for the first update, then collect all others arriving within the flush interval
+            update = self.queue.get()
+            deadline = time.time() + self.flush_interval
+            while update is not None:
+                self.pending.append(update)
+                try:
+                    update = self.queue.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+            stop = update is None
+
+            # write the batch, keeping it for the next attempt if the file is not available
+            try:
+                self._flush()
+            except Exception as e:
+                logger.error(f"Could not write {len(self.pending)} updates to {self.manager.filepath}, will retry: {e}")
+
+
+    def _flush(self):
+        """ Writes all pending updates. I/O errors keep the updates for the next attempt, which overwrites what has been written already, while updates failing for other reasons are dropped. """
+        if not self.pending: return
+        with self.manager._open() as f:
+            for update in self.pending:
+                try:
+                    self._write(f, *update)
+                except OSError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Dropping update of pipeline {update[1]} which cannot be written to {self.manager.filepath}: {e}")
+                    self.dropped.append(update)
+                    if update[1] in f: f[update[1]].attrs['status'] = f'Failed: {str(e)}'
+        logger.debug(f"Wrote {len(self.pending)} updates to {self.manager.filepath}.")
+        self.pending = []
+
+
+    def _write(self, f, action, uid, attributes, result, performance):
+        """ Applies a single update to the open file. The attributes are written last, such that a pipeline's status only changes once its result has been written. """
+        if action == 'remove':
+            if uid in f: del f[uid]
+            return
+        group = f.require_group(uid)
+        if result is not None: self.manager._write_attributes(group.require_group('result'), result)
+        if performance: self.manager._write_datasets(group.require_group('performance'), performance)
+        if attributes: self.manager._write_attributes(group, attributes)
+
+
+
 class HDF5Manager(BaseManager):
 
     TIMEOUT = 60
+    FLUSH_INTERVAL = 1.0
+    INITIATE_BATCH_SIZE = 1000  # number of pipelines whose parameters are written ahead of running them
 
     def __init__(self, filepath):
         super().__init__()
@@ -123,6 +352,9 @@ class HDF5Manager(BaseManager):
                 continue
             elif type(value) == str:
                 group.attrs[key] = value
+            elif np.array(value).dtype.kind == 'U':
+                # lists of strings need an explicit string type
+                group.attrs[key] = np.array(value, dtype=h5py.string_dtype())
             else:
                 group.attrs[key] = np.array(value)
 
@@ -130,46 +362,56 @@ class HDF5Manager(BaseManager):
     def _write_datasets(self, group, list_of_dictionaries):
         dictionary = {key: [d[key] for d in list_of_dictionaries] for key in list_of_dictionaries[0].keys()}
         for key, value in dictionary.items():
+            if key in group: del group[key]
             group[key] = value
 
 
-    def _run(self, pipelines):
+    def _run(self, pipelines, workers=1):
 
-        # write all of the parameters
-        uuids = [uuid.uuid4().hex for _ in pipelines]
-        with self._open() as f:
-            for i, (uid, pipeline) in enumerate(zip(uuids, pipelines)):
-                # create the overview
-                overview = {'id': uid, 'status': 'Initiated'}
+        # all writes go through a single writer, such that running pipelines never wait for the file
+        writer = HDF5Writer(self, flush_interval=self.FLUSH_INTERVAL)
+        writer.start()
+        try:
+            # run the pipelines, writing their parameters in batches ahead of them
+            on_start = lambda uid: writer.put(uid, attributes={'status': 'Running'})
+            for uid, result, performance, error in self._execute(self._initiate(pipelines, writer), workers=workers, on_start=on_start):
+                if error is not None:
+                    writer.put(uid, attributes={'status': f'Failed: {str(error)}'})
+                else:
+                    writer.put(uid, attributes={'status': 'Finished'}, result=result, performance=performance)
+        finally:
+            writer.close()
+
+
+    def _initiate(self, pipelines, writer):
+        """ Yields the pipelines with their uid, writing the parameters of each batch of pipelines before the first of them is run. If resuming, stale runs of the same pipelines are removed, they will be run again. """
+        unfinished = {}
+        if self.resume:
+            for uid, key, status, owner in self._get_statuses():
+                if status != 'Finished' and _is_stale(status, owner): unfinished.setdefault(key, []).append(uid)
+
+        pipelines = iter(pipelines)
+        while batch := list(itertools.islice(pipelines, self.INITIATE_BATCH_SIZE)):
+            uids = [uuid.uuid4().hex for _ in batch]
+            for uid, pipeline in zip(uids, batch):
+                overview = {'id': uid, 'key': pipeline.key, 'status': 'Initiated', 'owner': _owner()}
                 overview.update(bamboost.common.utilities.flatten_dict(pipeline.parameters))
-                # create the group for the pipeline
-                group = f.create_group(uid)
-                self._write_attributes(group, overview)
+                writer.remove(unfinished.pop(overview['key'], []))
+                writer.put(uid, attributes=overview)
+            yield from zip(uids, batch)
 
-        # run the pipelines
-        for i, (uid, pipeline) in enumerate(zip(uuids, pipelines)):
-            # set running status
-            with self._open() as f:
-                f[uid].attrs['status'] = 'Running'
 
-            # run the pipeline
-            try:
-                logger.info(f"Running pipeline: {pipeline} ({i+1}/{len(pipelines)})")
-                parameters, result, performance = self._run_pipeline(pipeline, uid=uid)
-            except Exception as e:
-                # set failed status
-                with self._open() as f:
-                    group = f[uid]
-                    group.attrs['status'] = f'Failed: {str(e)}'
-                continue
+    def _get_statuses(self):
+        """ Returns the uid, key, status, and owning process of all pipelines in the file. """
+        if not self.filepath.exists():
+            return []
+        with self._open() as f:
+            return [(uid, f[uid].attrs.get('key'), f[uid].attrs.get('status'), f[uid].attrs.get('owner')) for uid in f.keys()]
 
-            # write the results
-            with self._open() as f:
-                group = f.require_group(uid)
-                f[uid].attrs['status'] = 'Finished'
-                self._write_attributes(group.create_group('result'), result)
-                self._write_datasets(group.create_group('performance'), performance)
 
+    def _get_finished_keys(self):
+        return {key for uid, key, status, owner in self._get_statuses() if key and status == 'Finished'}
+    
 
     def get_data(self):
         if not pathlib.Path(self.filepath).exists():
@@ -229,37 +471,50 @@ class BamboostManager(BaseManager):
         self.bamboost_manager = bamboost_manager
     
 
-    def _run(self, pipelines):
-
-        # register and create the simulations
-        simulations = [self.bamboost_manager.create_simulation(
-            parameters = pipeline.parameters,
-            duplicate_action = 'r',
-        ) for pipeline in pipelines]
-
-        # iterate over the pipelines
-        for i, (pipeline, sim) in enumerate(zip(pipelines, simulations)):
-            # use the context manager to manage simulation state
-            with sim:
-                # run the pipeline
-                logger.info(f"Running pipeline: {pipeline} ({i+1}/{len(pipelines)})")
-                overview, result, performance = self._run_pipeline(pipeline, uid=sim.uid)
-
-                # add the performance data to the simulation
-                perf_data = sim.userdata.require_group('performance')
-                for key in performance[0].keys():
-                    if type(performance[0][key]) == str:
-                        perf_data.add_dataset(key, np.array([p[key] for p in performance]), dtype=h5py.string_dtype())
-                    else:
-                        perf_data[key] = np.array([p[key] for p in performance])
-
-                # add the result to the simulation data
-                result_data = sim.userdata.require_group('result')
-                for key, value in result.items():
-                    result_data[key] = value
-
-                # finish the simulation
-                sim.finish_sim()
+    def _run(self, pipelines, workers=1):
+
+        # register and create the simulations once the pipelines are taken for running
+        # unfinished runs with the same parameters are replaced
+        simulations = {}
+        def register(pipelines):
+            for pipeline in pipelines:
+                sim = self.bamboost_manager.create_simulation(
+                    parameters = {**pipeline.parameters, 'key': pipeline.key},
+                    duplicate_action = 'r',
+                )
+                simulations[sim.uid] = sim
+                yield sim.uid, pipeline
+
+        # iterate over the pipelines, tracking the simulation state
+        on_start = lambda uid: simulations[uid].change_status('Started')
+        for uid, result, performance, error in self._execute(register(pipelines), workers=workers, on_start=on_start):
+            sim = simulations.pop(uid)
+            if error is not None:
+                sim.change_status(f"Failed [{type(error).__name__}]")
+                raise error
+
+            # add the performance data to the simulation
+            perf_data = sim.userdata.require_group('performance')
+            for key in performance[0].keys():
+                if type(performance[0][key]) == str:
+                    perf_data.add_dataset(key, np.array([p[key] for p in performance]), dtype=h5py.string_dtype())
+                else:
+                    perf_data[key] = np.array([p[key] for p in performance])
+
+            # add the result to the simulation data
+            result_data = sim.userdata.require_group('result')
+            for key, value in result.items():
+                result_data[key] = value
+
+            # finish the simulation
+            sim.finish_sim()
+
+
+    def _get_finished_keys(self):
+        df = self.bamboost_manager.df
+        if 'key' not in df.columns:
+            return set()
+        return set(df.loc[df['status'] == 'Finished', 'key'])
 
 
     def get_data(self):
@@ -286,4 +541,16 @@ class BamboostManager(BaseManager):
             overview = self.bamboost_manager.df.copy(),
             results = pd.DataFrame(results),
             performances = pd.DataFrame(performances),
-        )    
\ No newline at end of file
+        )
+
+
+def _owner():
+    """ Identifies the process writing the records of its pipelines. """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _is_stale(status: str, owner: str):
+    """ Whether an unfinished record is left over, i.e. its run failed or the process owning it is gone. Records of other hosts, or without an owner, might still be in use and are never stale. """
+    if (status or '').startswith('Failed'): return True
+    host, _, pid = (owner or '').rpartition(':')
+    return host == socket.gethostname() and pid.isdigit() and not psutil.pid_exists(int(pid))
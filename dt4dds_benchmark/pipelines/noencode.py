@@ -66,7 +66,7 @@ class NoEncode(BasePipeline):
     def _customize_result(self, result):
         # assess the output
         output_exists = self.filepath_output.exists()
-        output_identical = files_are_equal(str(self.input_file), str(self.filepath_output))
+        output_identical = files_are_equal(str(self.input_file), str(self.filepath_output), use_digest=self.compare_by_digest)
         logger.warning(f"Decoding success: {output_exists and output_identical}, output file exists: {output_exists}, files are equal: {output_identical}")
         result['decoding_success'] = output_exists and output_identical
 
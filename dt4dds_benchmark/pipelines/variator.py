@@ -23,6 +23,7 @@ class FocusVariator():
     func_kwarg: str
     vary_range: list
     output_folder: str = ''
+    workers: int = 1
 
     vary_init_values: list = None
     vary_init_n: int = 10
@@ -41,14 +42,15 @@ class FocusVariator():
         if not self.vary_init_values:
             self.vary_init_values = np.logspace(*np.log10(self.vary_range), num=self.vary_init_n)
         pipelines = [self._create_pipeline(value) for value in self.vary_init_values]
-        self.manager.run(pipelines)
+        self.manager.run(pipelines, workers=self.workers, resume=False)
 
         # run focus iterations
         for i in range(self.vary_focus_iterations):
             logger.info(f"Starting focus iteration {i+1}/{self.vary_focus_iterations}.")
             new_points = self._verify_points(self._select_new_points())
+            # points selected again add replicates to the statistics of their value
             pipelines = [self._create_pipeline(value) for value in new_points]
-            self.manager.run(pipelines)
+            self.manager.run(pipelines, workers=self.workers, resume=False)
 
         logger.info(f"Finished focus variator.")
 
@@ -1,7 +1,10 @@
 from . import logs
 from .subprocess import SubProcess
+from .workers import WorkerProcess
 from .filedataframe import FileDataFrame
 from .step import Step
 from .stats import design_file_stats, encoding_stats
 from .file_compare import files_are_equal
-from .standardize import standardize_dict
\ No newline at end of file
+from .standardize import standardize_dict
+from .digest import dict_digest, file_digest
+from .cache import StepCache
\ No newline at end of file
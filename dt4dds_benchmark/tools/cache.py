@@ -0,0 +1,84 @@
+import dataclasses
+import pathlib
+import shutil
+import json
+import os
+import uuid
+
+from .digest import dict_digest, file_digest
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+@dataclasses.dataclass
+class StepCache():
+    """ Content-addressed cache for the output files of processing steps, keyed by the step's parameters and the contents of its input file. """
+
+    folder: pathlib.Path                        # path to the folder holding the cache entries
+    filename_metadata: str = 'metadata.json'    # name of the file with the metadata of a cache entry
+
+    def __post_init__(self):
+        self.folder = pathlib.Path(self.folder)
+
+
+    def key(self, step, input_file: pathlib.Path) -> str:
+        """ Returns the cache key for running the step on the input file. """
+        return dict_digest({'step': step.parameters, 'input': file_digest(input_file)})
+
+
+    def load(self, key: str, folder: pathlib.Path):
+        """ Copies the cached files into the folder and returns the cached metadata of the step, or None if the key is not cached. """
+        entry = self._entry(key)
+        if not (entry / self.filename_metadata).exists():
+            return None
+        with open(entry / self.filename_metadata, 'r') as f:
+            metadata = json.load(f)
+
+        copied = []
+        try:
+            for filename in metadata['files']:
+                copied.append(pathlib.Path(folder) / filename)
+                self._copy(entry / filename, copied[-1])
+        except OSError as e:
+            logger.warning(f"Could not load cache entry {key}: {e}")
+            for filepath in copied:
+                filepath.unlink(missing_ok=True)
+            return None
+        return metadata['performance']
+
+
+    def store(self, key: str, folder: pathlib.Path, filenames: list, performance: dict):
+        """ Stores copies of the files of the folder in a new cache entry, alongside the metadata of the step. Values of the metadata which are not JSON-serializable are stored as strings. """
+        entry = self._entry(key)
+        if entry.exists():
+            return
+
+        # populate a temporary entry first, such that concurrent readers never see incomplete entries
+        tmp_entry = self.folder / f".tmp-{uuid.uuid4().hex}"
+        try:
+            tmp_entry.mkdir(parents=True)
+            for filename in filenames:
+                (tmp_entry / filename).parent.mkdir(parents=True, exist_ok=True)
+                self._copy(pathlib.Path(folder) / filename, tmp_entry / filename)
+            with open(tmp_entry / self.filename_metadata, 'w') as f:
+                json.dump({'files': [str(filename) for filename in filenames], 'performance': performance}, f, default=str)
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(tmp_entry, entry)
+            logger.debug(f"Stored cache entry {key} with files {filenames}.")
+        except (OSError, TypeError, ValueError) as e:
+            # another process might have stored the same entry in the meantime, a failed store never fails the step
+            if not entry.exists():
+                logger.warning(f"Could not store cache entry {key}: {e}")
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+
+    def _entry(self, key: str) -> pathlib.Path:
+        return self.folder / key[:2] / key
+
+
+    def _copy(self, source: pathlib.Path, target: pathlib.Path):
+        """ Copies the source file to the target. Entries never share their files with pipelines, such that changing an output in place cannot alter the cache. """
+        shutil.copyfile(source, target)
@@ -0,0 +1,25 @@
+import hashlib
+import json
+import pathlib
+
+
+def dict_digest(d: dict) -> str:
+    """ Returns a stable hash of a (nested) dictionary of parameters, independent of the order of its keys. """
+    serialized = json.dumps(d, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def file_digest(filepath: pathlib.Path, chunk_size: int = 1024*1024, size: int = None) -> str:
+    """ Returns the hash of the contents of a file, read in chunks. If size is given, only the first size bytes are hashed. """
+    with open(filepath, 'rb') as f:
+        return stream_digest(f, chunk_size, size)
+
+
+def stream_digest(f, chunk_size: int = 1024*1024, size: int = None) -> str:
+    """ Returns the hash of the contents of a binary file object, read in chunks. If size is given, only the first size bytes are hashed. """
+    digest = hashlib.sha256()
+    remaining = size if size is not None else float('inf')
+    while remaining > 0 and (chunk := f.read(int(min(chunk_size, remaining)))):
+        digest.update(chunk)
+        remaining -= len(chunk)
+    return digest.hexdigest()
@@ -1,13 +1,18 @@
+import functools
 import pathlib
 import tarfile
-import tempfile
+
+from .digest import file_digest, stream_digest
 
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-def files_are_equal(original_file: pathlib.Path, compare_file: pathlib.Path) -> bool:
-    """ Check if two files are equal, but check contents of tar files instead of the tar file itself."""
+CHUNK_SIZE = 1024*1024  # number of bytes compared at once
+
+
+def files_are_equal(original_file: pathlib.Path, compare_file: pathlib.Path, use_digest: bool = False) -> bool:
+    """ Check if two files are equal, but check contents of tar files instead of the tar file itself. If use_digest is set, the contents are compared via the cached digest of the original file."""
     original_file = pathlib.Path(original_file)
     compare_file = pathlib.Path(compare_file)
     if not original_file.exists():
@@ -17,7 +22,7 @@ def files_are_equal(original_file: pathlib.Path, compare_file: pathlib.Path) ->
         logger.info(f"Comparison file {compare_file} does not exist.")
         return False
     
-    if compare_files(original_file, compare_file):
+    if compare_files(original_file, compare_file, use_digest=use_digest):
         logger.info(f"Files {original_file} and {compare_file} are bytewise equal.")
         return True
     elif compare_archives(original_file, compare_file):
@@ -30,56 +35,97 @@ def files_are_equal(original_file: pathlib.Path, compare_file: pathlib.Path) ->
         
                 
 
-def compare_files(original_file: pathlib.Path, compare_file: pathlib.Path) -> bool:
+def compare_files(original_file: pathlib.Path, compare_file: pathlib.Path, use_digest: bool = False) -> bool:
     """ Check if two files are equal by bytewise comparison. Ignores if the file to compare is longer than the original file."""
-    with open(original_file, "rb") as f, open(compare_file, "rb") as g:
-        i = 0
-        while (byte := f.read(1)):
-            i += 1
-            try:
-                other_byte = g.read(1)
-                if byte != other_byte:
-                    logger.info(f"Files are different at byte {i}: {byte} vs. {other_byte}")
+    try:
+        if use_digest:
+            size = pathlib.Path(original_file).stat().st_size
+            is_equal = file_digest(compare_file, CHUNK_SIZE, size=size) == original_digest(original_file)
+            if not is_equal:
+                logger.info("Files have different digests.")
+            return is_equal
+
+        with open(original_file, "rb") as f, open(compare_file, "rb") as g:
+            offset = 0
+            while (chunk := f.read(CHUNK_SIZE)):
+                other_chunk = g.read(len(chunk))
+                if chunk != other_chunk:
+                    i = next((i for i, (a, b) in enumerate(zip(chunk, other_chunk)) if a != b), len(other_chunk))
+                    logger.info(f"Files are different at byte {offset+i+1}: {chunk[i:i+1]} vs. {other_chunk[i:i+1]}")
                     return False
-            except:
-                return False
+                offset += len(chunk)
+    except OSError:
+        return False
     return True
 
 
+@functools.lru_cache(maxsize=32)
+def _cached_digest(filepath: pathlib.Path, size: int, mtime: int) -> str:
+    return file_digest(filepath, CHUNK_SIZE)
+
+
+def original_digest(original_file: pathlib.Path) -> str:
+    """ Returns the digest of the original file, cached for as long as the file is not modified. """
+    original_file = pathlib.Path(original_file).resolve()
+    stat = original_file.stat()
+    return _cached_digest(original_file, stat.st_size, stat.st_mtime_ns)
+
+
 def compare_archives(original_file: pathlib.Path, compare_file: pathlib.Path) -> bool:
-    """ Check if two archives are equal by comparing their contents."""
-    # create temporary directory
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # create subdirectories
-        tmpdir = pathlib.Path(tmpdir)
-        (tmpdir / "in").mkdir()
-        (tmpdir / "out").mkdir()
-
-        # extract both the input and the output files
-        try:
-            tar = tarfile.open(original_file, "r:gz")
-            tar.extractall(tmpdir / "in")
-            tar.close()
-        except Exception as e:
-            logger.info(f"Original file could not be extracted: {e}.")
-            return False
-        try:
-            tar = tarfile.open(compare_file, "r:gz")
-            tar.extractall(tmpdir / "out")
-            tar.close()
-        except Exception as e:
-            logger.info(f"Comparison file could not be extracted: {e}.")
-            return False
+    """ Check if two archives are equal by comparing their contents. Both archives are streamed, the contents of the original archive are hashed only once."""
+    try:
+        original_members = original_archive_members(original_file)
+    except Exception as e:
+        logger.info(f"Original file could not be read: {e}.")
+        return False
+    try:
+        compare_members = _archive_members(compare_file, original_members)
+    except Exception as e:
+        logger.info(f"Comparison file could not be read: {e}.")
+        return False
+
+    # directories may also exist implicitly as parents of other members
+    compare_folders = {parent for name in compare_members for parent in name.parents}
 
-        # compare all the files
-        for file in (tmpdir / "in").rglob("*"):
-            other_file = (tmpdir / "out" / file.relative_to(tmpdir / "in"))
-            if not other_file.exists():
-                logger.info(f"File {file} does not exist as {other_file}.")
+    # compare all the members
+    for name, (size, digest) in original_members.items():
+        if name not in compare_members and name not in compare_folders:
+            logger.info(f"Member {name} does not exist in {compare_file}.")
+            return False
+        if size is not None:
+            file_is_equal = compare_members.get(name) == digest
+            logger.info(f"Member {name} is equal: {file_is_equal}")
+            if not file_is_equal:
                 return False
-            if file.is_file():
-                file_is_equal = compare_files(file, other_file)
-                logger.info(f"File {file} is equal to {other_file}: {file_is_equal}")
-                if not file_is_equal:
-                    return False
-        return True
\ No newline at end of file
+    return True
+
+
+def original_archive_members(original_file: pathlib.Path) -> dict:
+    """ Returns the sizes and digests of the members of the original archive, cached for as long as the file is not modified. """
+    original_file = pathlib.Path(original_file).resolve()
+    stat = original_file.stat()
+    return _cached_archive_members(original_file, stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=32)
+def _cached_archive_members(filepath: pathlib.Path, size: int, mtime: int) -> dict:
+    return _archive_members(filepath)
+
+
+def _archive_members(filepath: pathlib.Path, original_members: dict = None) -> dict:
+    """ Streams through the archive and returns the size and digest of each file by its path, or None for other members. If the members of the original archive are given, returns the digests of each member up to the size of the original member instead. """
+    members = {}
+    with tarfile.open(filepath, "r|gz") as tar:
+        for member in tar:
+            name = pathlib.PurePosixPath(member.name)
+            if original_members is None:
+                members[name] = (member.size, stream_digest(tar.extractfile(member), CHUNK_SIZE)) if member.isfile() else (None, None)
+                continue
+
+            # like for single files, the compared member may be longer than the original one
+            size, _ = original_members.get(name, (None, None))
+            if size is None or not member.isfile() or member.size < size:
+                members[name] = None
+            else:
+                members[name] = stream_digest(tar.extractfile(member), CHUNK_SIZE, size=size)
+    return members
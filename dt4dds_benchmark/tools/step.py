@@ -16,8 +16,22 @@ class Step():
     type: str = dataclasses.field(init=False)
     name: str = 'unnamed'
 
+    # optional limits on the resources of the step's processes, not enforced if None
+    max_memory_gb: float = None     # memory of the whole process tree in GB
+    max_cpu_seconds: float = None   # CPU time of the whole process tree in seconds
+    cpu_affinity: list = None       # list of CPU cores the processes are restricted to
+
+    # whether the step reads its input or writes its output only once from start to end, such that it can be streamed through a named pipe
+    streams_input = False
+    streams_output = False
+
+    # settings that only change how the step is run, not its results, such that they are ignored when identifying runs
+    execution_options = ('max_memory_gb', 'max_cpu_seconds', 'cpu_affinity')
+
     identifier = property(lambda self: f"{self._class}:{self.type}-{self.name}")
     parameters = property(lambda self: standardize_dict(dataclasses.asdict(self)))
+    key_parameters = property(lambda self: {k: v for k, v in self.parameters.items() if k not in self.execution_options})
+    resource_limits = property(lambda self: {k: getattr(self, k) for k in ('max_memory_gb', 'max_cpu_seconds', 'cpu_affinity') if getattr(self, k) is not None})
 
     def __post_init__(self):
         self._class = 'Step'
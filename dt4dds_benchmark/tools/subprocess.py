@@ -1,7 +1,16 @@
 import psutil
 import pathlib
+import resource
+import signal
+import math
 import dataclasses
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import time
+import os
 
 import logging
 logger = logging.getLogger(__name__)
@@ -15,48 +24,83 @@ class ResourceStats():
     _sum_memory_percent = 0
     _sum_memory_value = 0
     n_data_points = 0
+    peak_rss = 0    # peak resident memory of the whole process tree in GB
+    peak_uss = 0    # peak unique memory of the whole process tree in GB
+    current_rss = 0 # resident memory of the whole process tree at the last update in GB
 
     cpu_percent = property(lambda self: self._sum_cpu_percent/max(self.n_data_points, 1))
     memory_percent = property(lambda self: self._sum_memory_percent/max(self.n_data_points, 1))
     memory_value = property(lambda self: self._sum_memory_value/max(self.n_data_points, 1))
+    n_processes = property(lambda self: len(self._processes))
+    cpu_time = property(lambda self: sum(self._cpu_times.values()))  # CPU time of all processes seen so far in seconds
+
+
+    def __init__(self):
+        self._processes = {}    # processes seen so far by pid, kept to measure their CPU usage between updates
+        self._cpu_times = {}    # last measured CPU time of the processes seen so far by pid
 
 
     def update(self, process: psutil.Process):
         """ Will update the resource stats by adding the stats of the given process and all its children. """
         if not process.is_running(): return
-        tot_cpu_percent, tot_memory_percent, tot_memory_value = self._get_process_stats(process)
+        tot_cpu_percent, tot_memory_percent, tot_memory_value, tot_rss = 0, 0, 0, 0
 
-        for pi in process.children(recursive=True):
-            if pi.is_running():
-                cpu_percent, memory_percent, memory_value = self._get_process_stats(pi)
-                tot_cpu_percent += cpu_percent
-                tot_memory_percent += memory_percent
-                tot_memory_value += memory_value
+        for pi in [process] + process.children(recursive=True):
+            try:
+                cpu_percent, memory_percent, memory_value, rss = self._get_process_stats(*self._track(pi))
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            tot_cpu_percent += cpu_percent
+            tot_memory_percent += memory_percent
+            tot_memory_value += memory_value
+            tot_rss += rss
 
         self._sum_cpu_percent += tot_cpu_percent
         self._sum_memory_percent += tot_memory_percent
         self._sum_memory_value += tot_memory_value
+        self.current_rss = tot_rss
+        self.peak_rss = max(self.peak_rss, tot_rss)
+        self.peak_uss = max(self.peak_uss, tot_memory_value)
         self.n_data_points += 1
 
+
+    def _track(self, process: psutil.Process):
+        """ Returns the tracked instance of the given process and whether it was not tracked before. """
+        tracked = self._processes.get(process.pid)
+        if tracked is not None and tracked == process:
+            return tracked, False
+        self._processes[process.pid] = process
+        return process, True
+
         
-    def _get_process_stats(self, process: psutil.Process):
-        """ Will return the CPU and memory stats of the given process. """
-        cpu_percent = process.cpu_percent(interval=0.1)
-        memory_percent = process.memory_percent('uss')
-        memory_value = process.memory_full_info().uss / (1024.0 ** 3) # to GB
+    def _get_process_stats(self, process: psutil.Process, is_new: bool = False):
+        """ Will return the CPU and memory stats of the given process. CPU usage is measured since the last call, or since the start of new processes. """
+        cpu_times = process.cpu_times()
+        self._cpu_times[process.pid] = cpu_times.user + cpu_times.system
+        if is_new:
+            # the first non-blocking measurement only sets the reference point for the next one
+            process.cpu_percent(interval=None)
+            cpu_percent = 100 * (cpu_times.user + cpu_times.system) / max(time.time() - process.create_time(), 1e-3)
+        else:
+            cpu_percent = process.cpu_percent(interval=None)
+        memory_info = process.memory_full_info()
+        memory_percent = 100 * memory_info.uss / psutil.virtual_memory().total
+        memory_value = memory_info.uss / (1024.0 ** 3) # to GB
+        rss = memory_info.rss / (1024.0 ** 3) # to GB
 
-        return cpu_percent, memory_percent, memory_value
+        return cpu_percent, memory_percent, memory_value, rss
 
     
-def kill_process_family(process):
-    processes = process.children(recursive=True)
-    processes.append(process)
+def kill_process_family(process, wait_parent: bool = True):
+    """ Kills the process and all its children. If wait_parent is False, the process itself is left to be reaped by the caller. """
+    children = process.children(recursive=True)
+    processes = children + [process]
     for p in processes:
         try:
             p.kill()
         except psutil.NoSuchProcess:
             pass
-    gone, alive = psutil.wait_procs(processes, timeout=10)
+    gone, alive = psutil.wait_procs(processes if wait_parent else children, timeout=10)
     if alive:
         logger.warning(f"Some processes were not killed within timeout: [{','.join([str(p) for p in alive])}]")
 
@@ -69,12 +113,20 @@ class SubProcess():
     monitor_interval: float = 0.2           # interval in seconds to collect subprocess resource data
     process_log_file: pathlib.Path = None   # path to the file to which the subprocess output will be written
     timeout: float = 1*60*60.0              # time in seconds until the subprocess is assumed to be dead and is killed
+    max_memory_gb: float = None             # memory in GB the process tree may use before it is killed, not limited if None, enforced per process before the command runs and for the tree by sampling
+    max_cpu_seconds: float = None           # CPU time in seconds the process tree may use before it is killed, not limited if None, enforced per process before the command runs and for the tree by sampling
+    cpu_affinity: list = None               # list of CPU cores the process tree is restricted to, not restricted if None
+
+    CPU_GRACE = 5                           # seconds between the soft and hard CPU time limit of a single process
+    MEMORY_ERRORS = ('MemoryError', 'Cannot allocate memory', 'std::bad_alloc', 'out of memory')   # messages of processes failing to allocate memory
 
     process = None
     return_code = None
     start_time = None
     end_time = None
     resource_stats = None
+    rusage = None
+    killed_reason = ''                      # why the process was killed, one of 'timeout', 'memory', 'cpu_time' or empty
 
     duration = property(lambda self: self.end_time - self.start_time)
 
@@ -87,45 +139,136 @@ class SubProcess():
             'cpu_percent': self.resource_stats.cpu_percent,
             'memory_percent': self.resource_stats.memory_percent,
             'memory_value': self.resource_stats.memory_value,
+            'memory_peak_rss': self.resource_stats.peak_rss,
+            'memory_peak_uss': self.resource_stats.peak_uss,
+            'cpu_user_time': self.rusage.ru_utime,
+            'cpu_system_time': self.rusage.ru_stime,
+            'io_read_bytes': 512 * self.rusage.ru_inblock,
+            'io_write_bytes': 512 * self.rusage.ru_oublock,
+            'n_child_processes': max(self.resource_stats.n_processes - 1, 0),
+            'killed_reason': self.killed_reason,
         }
 
-
     def __post_init__(self):
 
-        # create the log file handler if enabled
+        # create the log file handler if enabled, without log file the errors are collected to detect memory limit breaches
         if self.process_log_file is not None:
             self.process_log_file.parent.mkdir(parents=True, exist_ok=True)
-            stdout = self.process_log_file.open('w')
+            stdout = stderr = self.process_log_file.open('w+')
         else:
-            stdout = None
+            stdout, stderr = None, tempfile.TemporaryFile('w+') if self.max_memory_gb else None
 
-        # start the process
+        # start the process with the limits applied before the command is executed, such that they are inherited by all processes it starts
         self.start_time = time.time()
         self.resource_stats = ResourceStats()
         logger.debug(f"Starting subprocess: {' '.join(self.command_args)}")
-        self.process = psutil.Popen(self.command_args, stdout=stdout, stderr=stdout)
+        command = self._limited_command()
+        popen = subprocess.Popen(command or self.command_args, stdout=stdout, stderr=stderr)
+        self.process = psutil.Process(popen.pid)
+        if command is None:
+            self._apply_limits()
 
-        # wait for the process to finish, while collecting resource stats and monitoring time-out
-        last_update = 0
-        while self.process.poll() is None:
+        # wait for the process to finish, while collecting resource stats and monitoring time-out in the background
+        finished = threading.Event()
+        monitor = threading.Thread(target=self._monitor, args=(finished,), daemon=True)
+        monitor.start()
+        try:
+            # wait4 also yields the resources used by the process and all its waited-for descendants
+            _, status, self.rusage = os.wait4(popen.pid, 0)
+            self.return_code = popen.returncode = os.waitstatus_to_exitcode(status)
+            if self.return_code == -signal.SIGXCPU and not self.killed_reason:
+                self.killed_reason = 'cpu_time'
+            self._check_memory_errors(stderr)
+        finally:
+            finished.set()
+            monitor.join()
+            if stderr is not None and stdout is None:
+                # pass on the collected errors
+                stderr.seek(0)
+                sys.stderr.write(stderr.read())
+            if stderr is not None: stderr.close()
 
-            # check for resource stats update
-            if time.time()-last_update > self.monitor_interval:
-                try:
-                    self.resource_stats.update(self.process)
-                    last_update = time.time()
-                except psutil.NoSuchProcess:
-                    pass
+        # assign end time
+        self.end_time = time.time()
 
-            # check for time-out
-            if time.time() - self.start_time > self.timeout:
-                logger.critical(f"Subprocess timed out after {self.timeout} seconds, killing it.")
-                kill_process_family(self.process)
-                break
 
-            # sleep for a bit
-            time.sleep(0.05)
+    @property
+    def rlimits(self):
+        """ Returns the name, resource and (soft, hard) values of the rlimits of each single process. """
+        rlimits = []
+        if self.max_memory_gb:
+            limit = int(self.max_memory_gb * 1024**3)
+            rlimits.append(('data', resource.RLIMIT_DATA, (limit, limit)))
+        if self.max_cpu_seconds:
+            limit = math.ceil(self.max_cpu_seconds)
+            rlimits.append(('cpu', resource.RLIMIT_CPU, (limit, limit + self.CPU_GRACE)))
+        return rlimits
 
-        # assign return code and end time
-        self.return_code = self.process.wait()
-        self.end_time = time.time()
+
+    def _limited_command(self):
+        """ Returns the command wrapped by prlimit and taskset, which apply the limits before executing it, or None if a required tool is missing. Setting them in a preexec_fn instead is not safe in a process with threads. """
+        prefix = []
+        if self.rlimits:
+            if not shutil.which('prlimit'): return None
+            prefix += ['prlimit', *[f'--{name}={soft}:{hard}' for name, _, (soft, hard) in self.rlimits], '--']
+        if self.cpu_affinity:
+            if not shutil.which('taskset'): return None
+            prefix += ['taskset', '--cpu-list', ','.join(str(cpu) for cpu in self.cpu_affinity)]
+        return prefix + [str(arg) for arg in self.command_args]
+
+
+    def _apply_limits(self):
+        """ Applies the resource limits to the started process if they could not be applied before executing the command. This is best-effort, anything the process allocates or starts before is not limited. """
+        try:
+            for _, limit, values in self.rlimits:
+                resource.prlimit(self.process.pid, limit, values)
+            if self.cpu_affinity:
+                os.sched_setaffinity(self.process.pid, self.cpu_affinity)
+        except ProcessLookupError:
+            # the process has finished already
+            pass
+
+
+    def _check_memory_errors(self, output):
+        """ Records a breach of the memory limit if the failed process reported that it could not allocate memory in the end of its output. """
+        if not self.max_memory_gb or self.return_code == 0 or self.killed_reason or output is None:
+            return
+        output.flush()
+        size = os.fstat(output.fileno()).st_size
+        tail = os.pread(output.fileno(), 2**16, max(size - 2**16, 0)).decode(errors='replace')
+        if any(message in tail for message in self.MEMORY_ERRORS):
+            logger.critical(f"Subprocess failed to allocate memory within the limit of {self.max_memory_gb} GB.")
+            self.killed_reason = 'memory'
+
+
+    def _kill(self, reason: str, message: str):
+        """ Kills the process and all its children, recording the reason. """
+        logger.critical(message)
+        self.killed_reason = reason
+        try:
+            # the process itself is reaped by wait4, waiting for it here as well would race with it
+            kill_process_family(self.process, wait_parent=False)
+        except psutil.Error:
+            pass
+
+
+    def _monitor(self, finished: threading.Event):
+        """ Collects resource stats in regular intervals and kills the process if it times out, until the process has finished. """
+        while not finished.is_set():
+
+            # update the resource stats
+            try:
+                self.resource_stats.update(self.process)
+            except psutil.Error:
+                pass
+
+            # check for time-out and the limits of the whole process tree, the rlimits only apply to single processes
+            if time.time() - self.start_time > self.timeout:
+                return self._kill('timeout', f"Subprocess timed out after {self.timeout} seconds, killing it.")
+            if self.max_memory_gb and self.resource_stats.current_rss > self.max_memory_gb:
+                return self._kill('memory', f"Subprocess used {self.resource_stats.current_rss:.2f} GB of memory, exceeding the limit of {self.max_memory_gb} GB, killing it.")
+            if self.max_cpu_seconds and self.resource_stats.cpu_time > self.max_cpu_seconds:
+                return self._kill('cpu_time', f"Subprocess used {self.resource_stats.cpu_time:.1f} seconds of CPU time, exceeding the limit of {self.max_cpu_seconds} seconds, killing it.")
+
+            # sleep until the next update, or until the process has finished
+            finished.wait(self.monitor_interval)
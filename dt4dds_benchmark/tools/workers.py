@@ -0,0 +1,228 @@
+import contextlib
+import dataclasses
+import importlib.util
+import multiprocessing
+import multiprocessing.util
+import os
+import pathlib
+import resource
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+import psutil
+
+from .subprocess import SubProcess, ResourceStats
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Worker():
+    """ Long-lived process that runs the parse() function of Python scripts, keeping the scripts and their imports loaded between runs. Each run is forked off the worker, such that it starts from a clean state. """
+
+    is_alive = property(lambda self: self._process.is_alive())
+    exitcode = property(lambda self: self._process.exitcode)
+
+    def __init__(self):
+        self.owner = os.getpid()
+        self.connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(child_connection,), name='WorkflowWorker')
+        self._process.start()
+        child_connection.close()
+        self.process = psutil.Process(self._process.pid)
+
+
+    def start(self, script: str, args: list, log_file: str = None, post_command: list = None, cpu_affinity: list = None, rlimits: list = ()):
+        """ Starts a run of the script with the arguments and returns the process running it. The cpu affinity and the (resource, (soft, hard)) rlimits are applied to the run before the script is executed. """
+        self.connection.send((script, args, log_file, post_command, cpu_affinity, rlimits))
+        return psutil.Process(self.connection.recv())
+
+
+    def wait(self):
+        """ Waits for the current run to finish and returns its return code and resource usage. Raises EOFError if the worker died in the meantime. """
+        return self.connection.recv()
+
+
+    def close(self):
+        """ Stops the worker, killing it if it does not stop by itself. """
+        with contextlib.suppress(OSError):
+            self.connection.send(None)
+        self._process.join(timeout=10)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self.connection.close()
+
+
+def _serve(connection):
+    """ Runs the scripts received over the connection until it is closed. """
+    logging.getLogger().handlers.clear()
+    modules = {}
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        script, args, log_file, post_command, cpu_affinity, rlimits = task
+
+        # load the script and its imports once in the worker, errors are reported by the run itself
+        if script not in modules:
+            with contextlib.suppress(Exception):
+                modules[script] = _load_script(script)
+
+        pid = os.fork()
+        if pid == 0:
+            return_code = 1
+            try:
+                if cpu_affinity: os.sched_setaffinity(0, cpu_affinity)
+                for limit, values in rlimits: resource.setrlimit(limit, values)
+                return_code = _run_script(modules.get(script), script, args, log_file, post_command)
+            finally:
+                os._exit(return_code)
+
+        # report the run's process and, once it has finished, its return code and resources including those of its waited-for children
+        connection.send(pid)
+        _, status, rusage = os.wait4(pid, 0)
+        connection.send((os.waitstatus_to_exitcode(status), tuple(getattr(rusage, key) for key in ('ru_utime', 'ru_stime', 'ru_inblock', 'ru_oublock'))))
+
+
+def _load_script(script: str):
+    """ Imports the script as module. """
+    spec = importlib.util.spec_from_file_location(f"workflow_script_{abs(hash(script))}", script)
+    module = importlib.util.module_from_spec(spec)
+
+    # register the module like an import would, such that the processes of a pool started by the script can unpickle its functions
+    sys.modules[spec.name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[spec.name]
+        raise
+    return module
+
+
+def _run_script(module, script: str, args: list, log_file: str, post_command: list):
+    """ Runs the parse() function of the script and the optional post command, with all output redirected to the log file. Returns the return code of the run. """
+    with contextlib.ExitStack() as stack:
+        if log_file is not None:
+            f = stack.enter_context(open(log_file, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(f))
+            stack.enter_context(contextlib.redirect_stderr(f))
+
+        # log like the scripts do when run from the command line
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.INFO)
+
+        try:
+            (module or _load_script(script)).parse(args)
+            if post_command:
+                sys.stdout.flush()
+                return subprocess.run(post_command, stdout=sys.stdout, stderr=sys.stdout).returncode
+            return 0
+        except SystemExit as e:
+            # match the interpreter: no code is success, any other object is printed and fails
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.stdout.flush()
+
+
+#
+# pool of idle workers, one per process that uses them
+#
+
+_idle_workers = []
+_lock = threading.Lock()
+_finalizer_pid = None
+
+
+def _acquire_worker() -> Worker:
+    """ Returns an idle worker of this process, or starts a new one. """
+    global _finalizer_pid
+    with _lock:
+        # workers inherited from a parent process belong to it and are left alone
+        _idle_workers[:] = [worker for worker in _idle_workers if worker.owner == os.getpid()]
+        while _idle_workers:
+            worker = _idle_workers.pop()
+            if worker.is_alive:
+                return worker
+        if _finalizer_pid != os.getpid():
+            # stop the workers before multiprocessing waits for its children to exit
+            multiprocessing.util.Finalize(None, close_workers, exitpriority=10)
+            _finalizer_pid = os.getpid()
+    return Worker()
+
+
+def _release_worker(worker: Worker):
+    """ Returns the worker to the pool, or stops it if it is dead. """
+    if worker.is_alive:
+        with _lock:
+            _idle_workers.append(worker)
+    else:
+        worker.close()
+
+
+def close_workers():
+    """ Stops all idle workers of this process. """
+    with _lock:
+        workers = [worker for worker in _idle_workers if worker.owner == os.getpid()]
+        _idle_workers.clear()
+    for worker in workers:
+        worker.close()
+
+
+@dataclasses.dataclass
+class WorkerProcess(SubProcess):
+    """ Runs the parse() function of the Python script given as first command argument in a warm worker process instead of a new interpreter. Collects the same metadata as SubProcess. """
+
+    post_command: list = None   # command run by the worker after the script has succeeded, e.g. to convert its output
+
+    def __post_init__(self):
+
+        if self.process_log_file is not None:
+            self.process_log_file.parent.mkdir(parents=True, exist_ok=True)
+
+        # start the run on an idle worker
+        self.start_time = time.time()
+        self.resource_stats = ResourceStats()
+        worker = _acquire_worker()
+        script, args = str(pathlib.Path(self.command_args[0]).resolve()), [str(arg) for arg in self.command_args[1:]]
+        log_file = str(self.process_log_file) if self.process_log_file is not None else None
+        logger.debug(f"Running in worker {worker.process.pid}: {' '.join([script] + args)}")
+
+        # wait for the run to finish, while collecting resource stats and monitoring time-out in the background
+        finished = threading.Event()
+        monitor = threading.Thread(target=self._monitor, args=(finished,), daemon=True)
+        try:
+            self.process = worker.start(script, args, log_file, self.post_command, self.cpu_affinity, [(limit, values) for _, limit, values in self.rlimits])
+            monitor.start()
+            self.return_code, usage = worker.wait()
+            if log_file is not None:
+                with open(log_file, 'r') as f:
+                    self._check_memory_errors(f)
+        except (EOFError, OSError):
+            # the worker itself died
+            worker.close()
+            self.return_code, usage = worker.exitcode or 1, (0, 0, 0, 0)
+        finally:
+            finished.set()
+            if monitor.is_alive(): monitor.join()
+
+        _release_worker(worker)
+        self.rusage = types.SimpleNamespace(**dict(zip(('ru_utime', 'ru_stime', 'ru_inblock', 'ru_oublock'), usage)))
+
+        # assign end time
+        self.end_time = time.time()
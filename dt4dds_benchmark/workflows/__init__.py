@@ -8,4 +8,5 @@ from .errorgenerator_motifs import ErrorGeneratorMotifs
 from .serialdilution import SerialDilution
 from .serialpcr import SerialPCR
 from .downsampling import Downsampling
-from .baseworkflow import BaseWorkflow
\ No newline at end of file
+from .baseworkflow import BaseWorkflow
+from .sequencingworkflow import SequencingWorkflow
\ No newline at end of file
@@ -2,7 +2,7 @@ import time
 import pathlib
 import dataclasses
 
-from ..tools import Step
+from ..tools import Step, SubProcess, WorkerProcess
 
 import logging
 logger = logging.getLogger(__name__)
@@ -13,6 +13,10 @@ logger.setLevel(logging.DEBUG)
 class BaseWorkflow(Step):
     """ Abstract class for workflows. To be overridden by actual workflow implementations as a subclass. """
 
+    in_process: bool = False    # run the Python script of the workflow in a warm worker process instead of a new interpreter
+
+    execution_options = Step.execution_options + ('in_process',)
+
     def __post_init__(self):
         super().__post_init__()
         self._class = 'Workflow'
@@ -28,7 +32,7 @@ class BaseWorkflow(Step):
         start = time.time()
 
         try:
-            process = self._run_workflow(pathlib.Path(sequence_file), pathlib.Path(output_file), **kwargs)
+            process = self._run_workflow(pathlib.Path(sequence_file), pathlib.Path(output_file), **{**self.resource_limits, **kwargs})
             return process.metadata
         except Exception as e:
             logger.error(f"Workflow failed with {e}")
@@ -37,6 +41,15 @@ class BaseWorkflow(Step):
             logger.info(f"Workflow {self} took {time.time()-start:.1f} seconds")
 
 
+    def _run_command(self, cmd: list, **kwargs):
+        """ Runs the command of the workflow, or its Python script in a warm worker process if enabled. """
+        if not self.in_process:
+            return SubProcess(cmd, **kwargs)
+
+        # the script next to the command takes the same arguments
+        return WorkerProcess([str(pathlib.Path(cmd[0]).with_name('run.py')), *cmd[1:]], **kwargs)
+
+
     # 
     # override these methods in the subclass
     # 
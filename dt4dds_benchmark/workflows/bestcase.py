@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseworkflow import BaseWorkflow
-from ..tools import SubProcess
+from .sequencingworkflow import SequencingWorkflow
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,7 +9,7 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class BestCase(BaseWorkflow):
+class BestCase(SequencingWorkflow):
     """
     Best-case workflow assuming synthesis by material deposition and amplification by a high-fidelity polymerase.
 
@@ -20,6 +19,8 @@ class BestCase(BaseWorkflow):
     initial_coverage: float = 50
     aging_halflives: float = 0
     sequencing_depth: float = 50
+    checkpoint_folder: str = None   # folder to store the pool after the checkpoint stage and re-use it for identical designs, not used if None
+    checkpoint_stage: str = 'pcr'   # stage after which the pool is stored, either 'synthesis' or 'pcr'
 
     command_path = str(pathlib.Path(__file__).parent.absolute() / 'bin' / 'workflow_bestcase' / 'run.sh')
 
@@ -36,5 +37,6 @@ class BestCase(BaseWorkflow):
         if self.initial_coverage: cmd.extend(['--initial_coverage', str(self.initial_coverage)])
         if self.aging_halflives: cmd.extend(['--aging_halflives', str(self.aging_halflives)])
         if self.sequencing_depth: cmd.extend(['--sequencing_depth', str(self.sequencing_depth)])
+        if self.checkpoint_folder: cmd.extend(['--checkpoint_folder', str(pathlib.Path(self.checkpoint_folder).resolve()), '--checkpoint_stage', self.checkpoint_stage])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
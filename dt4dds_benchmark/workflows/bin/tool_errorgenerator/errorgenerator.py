@@ -0,0 +1,52 @@
+import pathlib
+import numpy as np
+
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+CODES = np.zeros(256, dtype=np.uint8)
+CODES[BASES] = np.arange(4)
+NEWLINE = ord('\n')
+BATCH_SIZE = 2**22  # maximum number of bases per batch of reads
+
+
+def read_design(design_file: pathlib.Path):
+    """ Returns the sequences in the design file as list of bytes. """
+    with open(design_file, 'rb') as f:
+        return [line.strip() for line in f if not line.startswith(b'>')]
+
+
+def generate_reads(sequences: list, coverage: int, rate_substitutions, rate_deletions, rate_insertions, rng: np.random.Generator):
+    """ Returns coverage reads per sequence with substitutions, deletions and insertions introduced, as newline-separated bytes. Each rate is either a single value or an array with one value per sequence. """
+    if not sequences or coverage <= 0:
+        return b''
+
+    # encode the design as matrix with one row per read, padded to the longest sequence
+    lengths = np.array([len(sequence) for sequence in sequences])
+    design = np.zeros((len(sequences), lengths.max()), dtype=np.uint8)
+    for i, sequence in enumerate(sequences):
+        design[i, :len(sequence)] = np.frombuffer(sequence, dtype=np.uint8)
+    reads = np.repeat(design, coverage, axis=0)
+    kept = np.arange(design.shape[1]) < np.repeat(lengths, coverage)[:, None]
+    rate_substitutions, rate_deletions, rate_insertions = (np.repeat(np.broadcast_to(np.asarray(rates, dtype=float), len(sequences)), coverage)[:, None] for rates in (rate_substitutions, rate_deletions, rate_insertions))
+
+    # substitutions replace a base by any of the other three bases
+    if np.any(rate_substitutions > 0):
+        substituted = kept & (rng.random(reads.shape) < rate_substitutions)
+        shifts = rng.integers(1, 4, size=np.count_nonzero(substituted), dtype=np.uint8)
+        reads[substituted] = BASES[(CODES[reads[substituted]] + shifts) % 4]
+
+    # deletions remove bases from the substituted read
+    if np.any(rate_deletions > 0):
+        kept &= rng.random(reads.shape) > rate_deletions
+
+    # insertions add a random base after any of the remaining bases
+    inserted = np.zeros_like(kept)
+    if np.any(rate_insertions > 0):
+        inserted = kept & (rng.random(reads.shape) < rate_insertions)
+
+    # interleave the bases with the inserted bases and terminate each read by a newline, then keep only the present ones
+    output = np.full((reads.shape[0], 2*reads.shape[1] + 1), NEWLINE, dtype=np.uint8)
+    present = np.ones(output.shape, dtype=bool)
+    output[:, 0:-1:2], present[:, 0:-1:2] = reads, kept
+    output[:, 1:-1:2][inserted], present[:, 1:-1:2] = BASES[rng.integers(0, 4, size=np.count_nonzero(inserted))], inserted
+    return output[present].tobytes()
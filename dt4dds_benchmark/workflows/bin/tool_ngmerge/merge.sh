@@ -0,0 +1,8 @@
+#!/bin/bash 
+set -e -o pipefail
+BASE_PATH="$(dirname -- "${BASH_SOURCE[0]}")"
+
+# merge the paired reads in the folder and stream the sequences of the merged reads into the txt file, passing on any filter options
+"$BASE_PATH"/run.sh "$1"/R1.fq.gz "$1"/R2.fq.gz /dev/stdout | python "$BASE_PATH"/to_reads.py - "$2" "${@:3}"
+
+exit
\ No newline at end of file
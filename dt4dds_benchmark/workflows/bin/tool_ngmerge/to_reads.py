@@ -0,0 +1,79 @@
+import argparse
+import contextlib
+import itertools
+import pathlib
+import sys
+import zlib
+
+
+CHUNK_SIZE = 2**22  # size of the chunks read from the FASTQ file
+GZIP_WBITS = 16 + zlib.MAX_WBITS  # expect a gzip header and trailer
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def read_chunks(fastq_file: pathlib.Path):
+    """ Yields the content of the FASTQ file (or stdin for -) in large chunks, decompressing all gzip members on the fly if the content is gzipped. """
+    with contextlib.nullcontext(sys.stdin.buffer) if str(fastq_file) == '-' else open(fastq_file, 'rb') as f_in:
+        # detect gzip by its magic bytes, as a pipe has no suffix to go by
+        chunks = iter(lambda: f_in.read(CHUNK_SIZE), b'')
+        first = next(chunks, b'')
+        if not first.startswith(GZIP_MAGIC):
+            if first:
+                yield first
+            yield from chunks
+            return
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        for chunk in itertools.chain([first], chunks):
+            while chunk:
+                yield decompressor.decompress(chunk)
+                if not decompressor.eof:
+                    break
+                # a new gzip member follows directly after the end of the previous one
+                chunk, decompressor = decompressor.unused_data, zlib.decompressobj(GZIP_WBITS)
+
+
+def read_sequences(fastq_file: pathlib.Path):
+    """ Yields the sequence lines of the FASTQ file in lists, without their line breaks. """
+    remainder, n_lines = b'', 0
+    for chunk in read_chunks(fastq_file):
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        yield lines[(1 - n_lines) % 4::4]
+        n_lines += len(lines)
+    if remainder and n_lines % 4 == 1:
+        yield [remainder]
+
+
+def convert(fastq_file: pathlib.Path, reads_file: pathlib.Path, min_length: int = 0, drop_n: bool = False):
+    """ Streams the sequence lines of the (gzipped) FASTQ file into the reads file, optionally dropping reads that are too short or contain N. """
+    n_reads, n_kept = 0, 0
+    with open(reads_file, 'wb') as f_out:
+        for sequences in read_sequences(fastq_file):
+            n_reads += len(sequences)
+            if min_length or drop_n:
+                sequences = [sequence for sequence in sequences if len(sequence.rstrip()) >= min_length and not (drop_n and b'N' in sequence)]
+            n_kept += len(sequences)
+            if sequences:
+                f_out.write(b'\n'.join(sequences) + b'\n')
+
+    if min_length or drop_n:
+        print(f"Kept {n_kept} of {n_reads} reads ({100*n_kept/max(n_reads, 1):.1f}%).")
+
+
+def parse(args):
+    parser = argparse.ArgumentParser(description='Convert the merged reads from FASTQ to a txt file with one sequence per line.')
+    parser.add_argument('fastq_file', type=str, help='FASTQ file with the merged reads, optionally gzipped, or - to read from stdin')
+    parser.add_argument('reads_file', type=str, help='Target file for output')
+    parser.add_argument('--min_length', type=int, help='Minimum length of the reads to keep', default=0)
+    parser.add_argument('--drop_n', action='store_true', help='Drop reads containing N')
+    args = parser.parse_args(args)
+
+    fastq_file = pathlib.Path(args.fastq_file)
+    if args.fastq_file != '-' and not fastq_file.exists():
+        raise FileNotFoundError(f"FASTQ file at {args.fastq_file} does not exist.")
+
+    return convert(fastq_file, pathlib.Path(args.reads_file), args.min_length, args.drop_n)
+
+
+if __name__ == "__main__":
+    parse(sys.argv[1:])
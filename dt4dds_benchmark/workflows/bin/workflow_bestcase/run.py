@@ -1,7 +1,12 @@
 import dt4dds
 import argparse
 import gc
+import hashlib
+import importlib.metadata
+import json
+import os
 import pathlib
+import pickle
 import sys
 
 import logging
@@ -9,7 +14,43 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def run(design_file, target_folder, init_cov, n_halflives, seq_depth):
+CHECKPOINT_STAGES = ['synthesis', 'pcr']  # stages after which the pool can be checkpointed, in order
+
+
+def checkpoint_file(checkpoint_folder, design_file, stage, settings):
+    """ Returns the path of the checkpoint of the pool after the given stage, keyed by the design and all settings up to this stage. """
+    key = json.dumps({
+        'design': hashlib.sha256(design_file.read_bytes()).hexdigest(),
+        'stage': stage,
+        'settings': [repr(setting) for setting in settings],
+        'dt4dds': importlib.metadata.version('dt4dds'),
+    }, sort_keys=True)
+    return pathlib.Path(checkpoint_folder) / f"bestcase_{stage}_{hashlib.sha256(key.encode()).hexdigest()}.pkl"
+
+
+def load_checkpoint(filepath):
+    """ Returns the pool stored in the checkpoint and restores the amplification efficiencies drawn up to it, or None if there is no checkpoint. """
+    if not filepath.exists():
+        return None
+    with open(filepath, 'rb') as f:
+        checkpoint = pickle.load(f)
+    dt4dds.properties.AmplificationEfficiency._efficiency_cache.update(checkpoint['efficiencies'])
+    logger.info(f"Loaded pool from checkpoint {filepath}")
+    return checkpoint['pool']
+
+
+def save_checkpoint(filepath, pool):
+    """ Stores the pool and the amplification efficiencies drawn up to it in the checkpoint. """
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_filepath = filepath.with_name(f"{filepath.name}.{os.getpid()}.tmp")
+    with open(tmp_filepath, 'wb') as f:
+        pickle.dump({'pool': pool, 'efficiencies': dt4dds.properties.AmplificationEfficiency._efficiency_cache}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # replace atomically, such that concurrent runs never load a partial checkpoint
+    os.replace(tmp_filepath, filepath)
+    logger.info(f"Saved pool to checkpoint {filepath}")
+
+
+def run(design_file, target_folder, init_cov, n_halflives, seq_depth, checkpoint_folder=None, checkpoint_stage='pcr'):
 
     logger.info(f"Running scenario on design file {design_file.resolve()} with output folder {target_folder.resolve()}")
     
@@ -17,18 +58,12 @@ def run(design_file, target_folder, init_cov, n_halflives, seq_depth):
     primers_2 = ["AATGATACGGCGACCACCGAGATCTACACTCTTTCCCTACACGACGCTCTTCCGATCT", "CAAGCAGAAGACGGCATACGAGATCGTGATGTGACTGGAGTTCAGACGTGTGCTCTTCCGATCT"]
 
     # assign efficiency properties
-    dt4dds.properties.set_property_settings(
-        dt4dds.settings.defaults.SequenceProperties(
-            efficiency_distribution='normal',
-            efficiency_params={'loc': 1.0, 'scale': 0.0051},
-        )
+    property_settings = dt4dds.settings.defaults.SequenceProperties(
+        efficiency_distribution='normal',
+        efficiency_params={'loc': 1.0, 'scale': 0.0051},
     )
+    dt4dds.properties.set_property_settings(property_settings)
 
-
-
-    # 
-    # synthesis
-    # 
     seq_list = dt4dds.tools.txt_to_seqlist(design_file)
     n_seqs = len(seq_list)
     logger.info(f"Total number of sequences: {n_seqs}")
@@ -37,36 +72,58 @@ def run(design_file, target_folder, init_cov, n_halflives, seq_depth):
         deletion_length_bias=None,
         deletion_read_bias=None,
     )
-    array_synthesis = dt4dds.processes.ArraySynthesis(synthesis_settings)
-    array_synthesis.process(seq_list)
-    pool = array_synthesis.sample_by_counts(1000*n_seqs)
-    pool = dt4dds.generators.attach_primers_to_pool(pool, *primers_0)
-    pool.volume = 1
+    pcr_settings = dt4dds.settings.defaults.PCR_Q5()(
+        primers=primers_0,
+        template_volume=1,
+        volume=20,
+        efficiency_mean=0.95,
+        n_cycles=15,
+    )
 
-    # free up space
-    del seq_list, array_synthesis
-    gc.collect()
-    logger.info("Finished synthesis")
+    # the pool after synthesis or the first PCR does not depend on the arguments of the workflow and can be re-used from a checkpoint
+    checkpoint, pool = None, None
+    if checkpoint_folder:
+        upstream_settings = [property_settings, primers_0, synthesis_settings, pcr_settings][:CHECKPOINT_STAGES.index(checkpoint_stage) + 3]
+        checkpoint = checkpoint_file(checkpoint_folder, design_file, checkpoint_stage, upstream_settings)
+        pool = load_checkpoint(checkpoint)
+    loaded = pool is not None
+
+
+
+    # 
+    # synthesis
+    # 
+    if not loaded:
+        array_synthesis = dt4dds.processes.ArraySynthesis(synthesis_settings)
+        array_synthesis.process(seq_list)
+        pool = array_synthesis.sample_by_counts(1000*n_seqs)
+        pool = dt4dds.generators.attach_primers_to_pool(pool, *primers_0)
+        pool.volume = 1
+
+        # free up space
+        del array_synthesis
+        gc.collect()
+        logger.info("Finished synthesis")
+
+        if checkpoint and checkpoint_stage == 'synthesis': save_checkpoint(checkpoint, pool)
+
+    del seq_list
 
 
 
     # 
     # PCR
     # 
-    pcr_settings = dt4dds.settings.defaults.PCR_Q5()
-    pcr = dt4dds.processes.PCR(pcr_settings(
-        primers=primers_0,
-        template_volume=1,
-        volume=20,
-        efficiency_mean=0.95,
-        n_cycles=15,
-    ))
-    pool = pcr.process(pool)
+    if not (loaded and checkpoint_stage == 'pcr'):
+        pcr = dt4dds.processes.PCR(pcr_settings)
+        pool = pcr.process(pool)
 
-    # free up space
-    del pcr
-    gc.collect()
-    logger.info("Finished PCR 1")
+        # free up space
+        del pcr
+        gc.collect()
+        logger.info("Finished PCR 1")
+
+        if checkpoint and checkpoint_stage == 'pcr': save_checkpoint(checkpoint, pool)
 
 
 
@@ -133,6 +190,8 @@ def parse(args):
     parser.add_argument('--initial_coverage', '-c', type=float, help='Initial coverage', default=50)
     parser.add_argument('--aging_halflives', '-a', type=float, help='Aging halflives', default=0)
     parser.add_argument('--sequencing_depth', '-s', type=float, help='Sequencing depth', default=50)
+    parser.add_argument('--checkpoint_folder', type=str, help='Folder for checkpoints of the pool, not used if not given', default=None)
+    parser.add_argument('--checkpoint_stage', type=str, help='Stage after which the pool is checkpointed', choices=CHECKPOINT_STAGES, default='pcr')
 
     args = parser.parse_args(args)
 
@@ -145,7 +204,7 @@ def parse(args):
         target_folder.mkdir(parents=True)
         logger.warning(f"Target folder at {args.target_folder} did not exist and was created.")
 
-    return run(design_file, target_folder, args.initial_coverage, args.aging_halflives, args.sequencing_depth)
+    return run(design_file, target_folder, args.initial_coverage, args.aging_halflives, args.sequencing_depth, args.checkpoint_folder, args.checkpoint_stage)
 
 
 if __name__ == "__main__":
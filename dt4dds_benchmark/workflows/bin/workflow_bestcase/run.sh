@@ -2,15 +2,18 @@
 set -e
 BASE_PATH="$(dirname -- "${BASH_SOURCE[0]}")"
 
-# run the workflow
-python "$BASE_PATH"/run.py "$1" "$(dirname "$2")" "${@:3}"
+# options after "--" are passed on to the conversion of the merged reads
+WORKFLOW_ARGS=()
+READS_ARGS=()
+for ((i=3; i<=$#; i++)); do
+    if [ "${!i}" == "--" ]; then READS_ARGS=("${@:i+1}"); break; fi
+    WORKFLOW_ARGS+=("${!i}")
+done
 
-# merge the paired reads
-"$BASE_PATH"/../tool_ngmerge/run.sh "$(dirname "$2")"/R1.fq.gz "$(dirname "$2")"/R2.fq.gz "$2".fq.gz
-gunzip "$2".fq.gz
+# run the workflow
+python "$BASE_PATH"/run.py "$1" "$(dirname "$2")" "${WORKFLOW_ARGS[@]}"
 
-# convert fastq to txt file
-awk 'NR%4==2' "$2".fq > "$2"
-rm -f "$2".fq
+# merge the paired reads and convert them to a txt file
+"$BASE_PATH"/../tool_ngmerge/merge.sh "$(dirname "$2")" "$2" "${READS_ARGS[@]}"
 
 exit
\ No newline at end of file
@@ -1,70 +1,78 @@
 import argparse
+import contextlib
+import multiprocessing
 import pathlib
+import sys
 import numpy as np
 
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-rng = np.random.default_rng()
-
-parser = argparse.ArgumentParser(description='Error generator to introduce pre-defined error patterns.')
-parser.add_argument('design_file', type=str, help='Design file to simulate')
-parser.add_argument('reads_file', type=str, help='Target file for output')
-parser.add_argument('--rate_substitutions', type=float, help='Substitution rate', default=0)
-parser.add_argument('--rate_deletions', type=float, help='Deletion rate', default=0)
-parser.add_argument('--rate_insertions', type=float, help='Insertion rate', default=0)
-parser.add_argument('--coverage', type=float, help='Coverage', default=20)
-parser.add_argument('--dropout', type=float, help='Dropout', default=0)
-args = parser.parse_args()
-
-design_file = pathlib.Path(args.design_file)
-if not design_file.exists():
-    raise FileNotFoundError(f"Design file at {args.design_file} does not exist.")
-
-reads_file = pathlib.Path(args.reads_file)
-if reads_file.exists():
-    raise FileExistsError(f"Reads file at {args.reads_file} already exists.")
-
-
-def introduce_substitution(sequence: str, rate: float):
-    new_bases = []
-    for base in sequence:
-        if rng.random() < rate:
-            new_bases.append(rng.choice([b for b in ['A', 'C', 'G', 'T'] if b != base]))
-        else:
-            new_bases.append(base)
-    return ''.join(new_bases)
-
-
-def introduce_deletion(sequence: str, rate: float):
-    return ''.join([base for base in sequence if rng.random() > rate])
-
-
-def introduce_insertion(sequence: str, rate: float):
-    new_bases = []
-    for base in sequence:
-        new_bases.append(base)
-        if rng.random() < rate:
-            new_bases.append(rng.choice(['A', 'C', 'G', 'T']))
-    return ''.join(new_bases)
-
-n_dropped, n_added = 0, 0
-with open(design_file, 'r') as f_in, open(reads_file, 'w') as f_out:
-    for line in f_in:
-        if line.startswith('>'):
-            continue
-        else:
-            sequence = line.strip()
-            if rng.random() > args.dropout:
-                n_added += 1
-                for _ in range(int(args.coverage)):
-                    read = introduce_substitution(sequence, args.rate_substitutions)
-                    read = introduce_deletion(read, args.rate_deletions)
-                    read = introduce_insertion(read, args.rate_insertions)
-                    f_out.write(read + '\n')
-            else:
-                n_dropped += 1
-
-tot = n_added + n_dropped
-print(f"Added {n_added} ({100*n_added/tot:.1f}%) sequences and dropped {n_dropped} ({100*n_dropped/tot:.1f}%) sequences.")
\ No newline at end of file
+
+# the error model is shared by both error generators
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'tool_errorgenerator'))
+from errorgenerator import BATCH_SIZE, read_design, generate_reads
+
+
+def generate_shard(sequences: list, seed: np.random.SeedSequence, coverage: int, rate_substitutions: float, rate_deletions: float, rate_insertions: float, dropout: float):
+    """ Drops out sequences and generates the reads of the remaining ones for a shard of the design, returning the reads and the number of added sequences. """
+    rng = np.random.default_rng(seed)
+    added = rng.random(len(sequences)) > dropout
+    sequences = [sequence for sequence, is_added in zip(sequences, added) if is_added]
+    return generate_reads(sequences, coverage, rate_substitutions, rate_deletions, rate_insertions, rng), len(sequences)
+
+
+def run(design_file, reads_file, rate_substitutions, rate_deletions, rate_insertions, coverage, dropout, seed=None, threads=1):
+
+    # shards of similar total size get their own random streams, so the reads only depend on the seed and not on the number of threads
+    sequences = read_design(design_file)
+    shard_length = max(1, BATCH_SIZE // max(1, int(coverage) * max(map(len, sequences), default=1)))
+    shards = [sequences[i:i+shard_length] for i in range(0, len(sequences), shard_length)]
+    seed_sequence = np.random.SeedSequence(seed)
+    print(f"Using seed {seed_sequence.entropy} for {len(shards)} shards with {threads} threads.")
+    tasks = [(shard, shard_seed, int(coverage), rate_substitutions, rate_deletions, rate_insertions, dropout) for shard, shard_seed in zip(shards, seed_sequence.spawn(len(shards)))]
+
+    # write the reads of the shards in order as they are generated
+    n_added = 0
+    with open(reads_file, 'wb') as f_out, multiprocessing.Pool(threads) if threads > 1 else contextlib.nullcontext() as pool:
+        results = pool.imap(_generate_shard, tasks) if pool else map(_generate_shard, tasks)
+        for reads, n_shard_added in results:
+            f_out.write(reads)
+            n_added += n_shard_added
+
+    n_dropped = len(sequences) - n_added
+    tot = n_added + n_dropped
+    print(f"Added {n_added} ({100*n_added/tot:.1f}%) sequences and dropped {n_dropped} ({100*n_dropped/tot:.1f}%) sequences.")
+
+
+def _generate_shard(task):
+    return generate_shard(*task)
+
+
+def parse(args):
+    parser = argparse.ArgumentParser(description='Error generator to introduce pre-defined error patterns.')
+    parser.add_argument('design_file', type=str, help='Design file to simulate')
+    parser.add_argument('reads_file', type=str, help='Target file for output')
+    parser.add_argument('--rate_substitutions', type=float, help='Substitution rate', default=0)
+    parser.add_argument('--rate_deletions', type=float, help='Deletion rate', default=0)
+    parser.add_argument('--rate_insertions', type=float, help='Insertion rate', default=0)
+    parser.add_argument('--coverage', type=float, help='Coverage', default=20)
+    parser.add_argument('--dropout', type=float, help='Dropout', default=0)
+    parser.add_argument('--seed', type=int, help='Seed of the random number generator, random if not given', default=None)
+    parser.add_argument('--threads', type=int, help='Number of worker processes', default=1)
+    args = parser.parse_args(args)
+
+    design_file = pathlib.Path(args.design_file)
+    if not design_file.exists():
+        raise FileNotFoundError(f"Design file at {args.design_file} does not exist.")
+
+    reads_file = pathlib.Path(args.reads_file)
+    if reads_file.exists() and not reads_file.is_fifo():
+        raise FileExistsError(f"Reads file at {args.reads_file} already exists.")
+
+    return run(design_file, reads_file, args.rate_substitutions, args.rate_deletions, args.rate_insertions, args.coverage, args.dropout, args.seed, args.threads)
+
+
+if __name__ == "__main__":
+    parse(sys.argv[1:])
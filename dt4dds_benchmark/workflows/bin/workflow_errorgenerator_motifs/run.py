@@ -1,93 +1,157 @@
 import argparse
+import collections
+import hashlib
+import os
 import pathlib
+import sys
 import numpy as np
 
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-rng = np.random.default_rng()
-
-parser = argparse.ArgumentParser(description='Error generator to introduce pre-defined error patterns with a bias for motif-containing sequences.')
-parser.add_argument('design_file', type=str, help='Design file to simulate')
-parser.add_argument('reads_file', type=str, help='Target file for output')
-parser.add_argument('--rate_substitutions', type=float, help='Substitution rate', default=0)
-parser.add_argument('--rate_deletions', type=float, help='Deletion rate', default=0)
-parser.add_argument('--rate_insertions', type=float, help='Insertion rate', default=0)
-parser.add_argument('--rate_substitutions_motif', type=float, help='Substitution rate', default=0)
-parser.add_argument('--rate_deletions_motif', type=float, help='Deletion rate', default=0)
-parser.add_argument('--rate_insertions_motif', type=float, help='Insertion rate', default=0)
-parser.add_argument('--coverage', type=float, help='Coverage', default=20)
-parser.add_argument('--dropout', type=float, help='Dropout', default=0)
-parser.add_argument('--dropout_motif', type=float, help='Dropout', default=0)
-args = parser.parse_args()
+
+# the error model is shared by both error generators
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'tool_errorgenerator'))
+from errorgenerator import BATCH_SIZE, read_design, generate_reads
 
 # get the undesired motifs from the file relative to the script location
-script_path = pathlib.Path(__file__).parent.resolve()
-motifs = open(f'{script_path}/undesired_sequences.fasta', 'r').read().splitlines()
-motifs = set([line.strip() for line in motifs if not line.startswith('>')])
-
-design_file = pathlib.Path(args.design_file)
-if not design_file.exists():
-    raise FileNotFoundError(f"Design file at {args.design_file} does not exist.")
-
-reads_file = pathlib.Path(args.reads_file)
-if reads_file.exists():
-    raise FileExistsError(f"Reads file at {args.reads_file} already exists.")
-
-
-def introduce_substitution(sequence: str, rate: float):
-    new_bases = []
-    for base in sequence:
-        if rng.random() < rate:
-            new_bases.append(rng.choice([b for b in ['A', 'C', 'G', 'T'] if b != base]))
-        else:
-            new_bases.append(base)
-    return ''.join(new_bases)
-
-
-def introduce_deletion(sequence: str, rate: float):
-    return ''.join([base for base in sequence if rng.random() > rate])
-
-
-def introduce_insertion(sequence: str, rate: float):
-    new_bases = []
-    for base in sequence:
-        new_bases.append(base)
-        if rng.random() < rate:
-            new_bases.append(rng.choice(['A', 'C', 'G', 'T']))
-    return ''.join(new_bases)
-
-n_dropped, n_added = 0, 0
-with open(design_file, 'r') as f_in, open(reads_file, 'w') as f_out:
-    for line in f_in:
-        if line.startswith('>'):
-            continue
-        else:
-            sequence = line.strip()
-
-            if any(motif in sequence for motif in motifs):
-                # introduce errors with motif-specific rates
-                dropout = args.dropout_motif
-                rate_substitutions = args.rate_substitutions_motif
-                rate_deletions = args.rate_deletions_motif
-                rate_insertions = args.rate_insertions_motif
-            else:
-                # introduce errors with general rates
-                dropout = args.dropout
-                rate_substitutions = args.rate_substitutions
-                rate_deletions = args.rate_deletions
-                rate_insertions = args.rate_insertions
-
-            if rng.random() > dropout:
-                n_added += 1
-                for _ in range(int(args.coverage)):
-                    read = introduce_substitution(sequence, rate_substitutions)
-                    read = introduce_deletion(read, rate_deletions)
-                    read = introduce_insertion(read, rate_insertions)
-                    f_out.write(read + '\n')
-            else:
-                n_dropped += 1
-
-tot = n_added + n_dropped
-print(f"Added {n_added} ({100*n_added/tot:.1f}%) sequences and dropped {n_dropped} ({100*n_dropped/tot:.1f}%) sequences.")
\ No newline at end of file
+MOTIF_FILE = pathlib.Path(__file__).parent.resolve() / 'undesired_sequences.fasta'
+AUTOMATON_FILE = MOTIF_FILE.with_suffix('.automaton.npz')
+
+
+class MotifMatcher():
+    """ Aho-Corasick automaton over a set of motifs, which finds all sequences containing any of the motifs in a single pass. """
+
+    def __init__(self, motifs: set):
+        # the alphabet consists of all characters in the motifs, all other characters are mapped to the last column
+        alphabet = sorted(set(''.join(motifs)))
+        self.columns = np.full(256, len(alphabet), dtype=np.uint8)
+        self.columns[[ord(c) for c in alphabet]] = np.arange(len(alphabet))
+
+        # build the trie of the motifs
+        children, accepting = [{}], [False]
+        for motif in motifs:
+            state = 0
+            for c in motif:
+                if c not in children[state]:
+                    children[state][c] = len(children)
+                    children.append({})
+                    accepting.append(False)
+                state = children[state][c]
+            accepting[state] = True
+
+        # add the failure transitions in breadth-first order, resulting in a transition table with one row per state
+        self.transitions = np.zeros((len(children), len(alphabet) + 1), dtype=np.int32)
+        self.accepting = np.array(accepting, dtype=bool)
+        failure = [0] * len(children)
+        queue = collections.deque([0])
+        while queue:
+            state = queue.popleft()
+            self.accepting[state] |= self.accepting[failure[state]]
+            for i, c in enumerate(alphabet):
+                if c in children[state]:
+                    child = children[state][c]
+                    failure[child] = self.transitions[failure[state], i] if state else 0
+                    self.transitions[state, i] = child
+                    queue.append(child)
+                else:
+                    self.transitions[state, i] = self.transitions[failure[state], i]
+
+
+    @classmethod
+    def from_fasta(cls, fasta_file: pathlib.Path, cache_file: pathlib.Path):
+        """ Returns the matcher for the motifs in the FASTA file, re-using the automaton cached in the cache file if it was built from the same FASTA file. """
+        digest = hashlib.sha256(fasta_file.read_bytes()).hexdigest()
+        matcher = cls.__new__(cls)
+        try:
+            with np.load(cache_file) as cached:
+                if str(cached['digest']) == digest:
+                    matcher.columns, matcher.transitions, matcher.accepting = cached['columns'], cached['transitions'], cached['accepting']
+                    return matcher
+        except (OSError, KeyError, ValueError):
+            pass
+
+        motifs = fasta_file.read_text().splitlines()
+        matcher = cls(set([line.strip() for line in motifs if not line.startswith('>')]))
+        try:
+            # write to a temporary file first, so that concurrent runs never read a partial cache file
+            tmp_file = cache_file.with_name(f'{cache_file.stem}.{os.getpid()}.tmp.npz')
+            np.savez(tmp_file, digest=digest, columns=matcher.columns, transitions=matcher.transitions, accepting=matcher.accepting)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            logger.warning(f"Motif automaton could not be cached at {cache_file}: {e}")
+        return matcher
+
+
+    def contains_motif(self, sequences: list):
+        """ Returns a boolean array indicating which of the sequences contain any of the motifs. """
+        lengths = np.array([len(sequence) for sequence in sequences])
+        other = self.transitions.shape[1] - 1
+        columns = np.full((len(sequences), lengths.max(initial=0)), other, dtype=np.uint8)
+        for i, sequence in enumerate(sequences):
+            columns[i, :len(sequence)] = self.columns[np.frombuffer(sequence, dtype=np.uint8)]
+
+        # advance the automaton of all sequences at once, padding resets it to the root which accepts only for an empty motif
+        states = np.zeros(len(sequences), dtype=np.int32)
+        matched = self.accepting[states]
+        for i in range(columns.shape[1]):
+            states = self.transitions[states, columns[:, i]]
+            matched |= self.accepting[states]
+        return matched
+
+
+def run(design_file, reads_file, rates, rates_motif, coverage, dropout, dropout_motif):
+
+    rng = np.random.default_rng()
+
+    # sequences with motifs get the motif-specific rates, all others the general rates
+    sequences = read_design(design_file)
+    has_motif = MotifMatcher.from_fasta(MOTIF_FILE, AUTOMATON_FILE).contains_motif(sequences)
+    rates = np.where(has_motif[:, None], rates_motif, rates)
+
+    # drop out sequences as a whole
+    added = rng.random(len(sequences)) > np.where(has_motif, dropout_motif, dropout)
+    sequences, rates = [sequence for sequence, is_added in zip(sequences, added) if is_added], rates[added]
+    n_added, n_dropped = len(sequences), len(added) - len(sequences)
+
+    # generate the reads in batches of similar total size
+    batch_length = max(1, BATCH_SIZE // max(1, int(coverage) * max(map(len, sequences), default=1)))
+    with open(reads_file, 'wb') as f_out:
+        for i in range(0, len(sequences), batch_length):
+            f_out.write(generate_reads(sequences[i:i+batch_length], int(coverage), *rates[i:i+batch_length].T, rng))
+
+    tot = n_added + n_dropped
+    print(f"Added {n_added} ({100*n_added/tot:.1f}%) sequences and dropped {n_dropped} ({100*n_dropped/tot:.1f}%) sequences.")
+
+
+def parse(args):
+    parser = argparse.ArgumentParser(description='Error generator to introduce pre-defined error patterns with a bias for motif-containing sequences.')
+    parser.add_argument('design_file', type=str, help='Design file to simulate')
+    parser.add_argument('reads_file', type=str, help='Target file for output')
+    parser.add_argument('--rate_substitutions', type=float, help='Substitution rate', default=0)
+    parser.add_argument('--rate_deletions', type=float, help='Deletion rate', default=0)
+    parser.add_argument('--rate_insertions', type=float, help='Insertion rate', default=0)
+    parser.add_argument('--rate_substitutions_motif', type=float, help='Substitution rate', default=0)
+    parser.add_argument('--rate_deletions_motif', type=float, help='Deletion rate', default=0)
+    parser.add_argument('--rate_insertions_motif', type=float, help='Insertion rate', default=0)
+    parser.add_argument('--coverage', type=float, help='Coverage', default=20)
+    parser.add_argument('--dropout', type=float, help='Dropout', default=0)
+    parser.add_argument('--dropout_motif', type=float, help='Dropout', default=0)
+    args = parser.parse_args(args)
+
+    design_file = pathlib.Path(args.design_file)
+    if not design_file.exists():
+        raise FileNotFoundError(f"Design file at {args.design_file} does not exist.")
+
+    reads_file = pathlib.Path(args.reads_file)
+    if reads_file.exists() and not reads_file.is_fifo():
+        raise FileExistsError(f"Reads file at {args.reads_file} already exists.")
+
+    rates = [args.rate_substitutions, args.rate_deletions, args.rate_insertions]
+    rates_motif = [args.rate_substitutions_motif, args.rate_deletions_motif, args.rate_insertions_motif]
+    return run(design_file, reads_file, rates, rates_motif, args.coverage, args.dropout, args.dropout_motif)
+
+
+if __name__ == "__main__":
+    parse(sys.argv[1:])
@@ -2,7 +2,6 @@ import dataclasses
 import pathlib
 
 from .baseworkflow import BaseWorkflow
-from ..tools import SubProcess
 
 import logging
 logger = logging.getLogger(__name__)
@@ -23,16 +22,20 @@ class ErrorGenerator(BaseWorkflow):
     overall_rate: float = dataclasses.field(init=False)
     coverage: float = 20
     dropout: float = 0
+    seed: int = None        # seed of the random number generator, random if None
+    threads: int = 1        # number of worker processes, the reads do not depend on it
 
+    streams_output = True
+    execution_options = BaseWorkflow.execution_options + ('threads',)
     command_path = str(pathlib.Path(__file__).parent.absolute() / 'bin' / 'workflow_errorgenerator' / 'run.sh')
 
 
     @classmethod
-    def from_ratio(cls, overall_rate: float, r_subs: float = 8, r_dels: float = 1.9, r_ins: float = 0.1, coverage: float = 20, dropout: float = 0):
+    def from_ratio(cls, overall_rate: float, r_subs: float = 8, r_dels: float = 1.9, r_ins: float = 0.1, coverage: float = 20, dropout: float = 0, **kwargs):
         rate_subs = float(overall_rate) * r_subs / (r_subs + r_dels + r_ins)
         rate_dels = float(overall_rate) * r_dels / (r_subs + r_dels + r_ins)
         rate_ins = float(overall_rate) * r_ins / (r_subs + r_dels + r_ins)
-        return cls(rate_substitutions=rate_subs, rate_deletions=rate_dels, rate_insertions=rate_ins, coverage=coverage, dropout=dropout)
+        return cls(rate_substitutions=rate_subs, rate_deletions=rate_dels, rate_insertions=rate_ins, coverage=coverage, dropout=dropout, **kwargs)
 
 
     def __post_init__(self):
@@ -54,5 +57,7 @@ class ErrorGenerator(BaseWorkflow):
         cmd.extend(['--rate_insertions', str(self.rate_insertions)])
         cmd.extend(['--coverage', str(self.coverage)])
         cmd.extend(['--dropout', str(self.dropout)])
+        if self.seed is not None: cmd.extend(['--seed', str(self.seed)])
+        if self.threads > 1: cmd.extend(['--threads', str(self.threads)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
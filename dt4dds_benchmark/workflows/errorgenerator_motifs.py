@@ -2,7 +2,6 @@ import dataclasses
 import pathlib
 
 from .baseworkflow import BaseWorkflow
-from ..tools import SubProcess
 
 import logging
 logger = logging.getLogger(__name__)
@@ -29,6 +28,7 @@ class ErrorGeneratorMotifs(BaseWorkflow):
     dropout: float = 0
     dropout_motif: float = 0
 
+    streams_output = True
     command_path = str(pathlib.Path(__file__).parent.absolute() / 'bin' / 'workflow_errorgenerator_motifs' / 'run.sh')
 
 
@@ -78,4 +78,4 @@ class ErrorGeneratorMotifs(BaseWorkflow):
         cmd.extend(['--dropout', str(self.dropout)])
         cmd.extend(['--dropout_motif', str(self.dropout_motif)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
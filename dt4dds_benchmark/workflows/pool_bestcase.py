@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseworkflow import BaseWorkflow
-from ..tools import SubProcess
+from .sequencingworkflow import SequencingWorkflow
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,7 +9,7 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class Pool_Bestcase(BaseWorkflow):
+class Pool_Bestcase(SequencingWorkflow):
     """
     Pool workflow assuming synthesis by material deposition methods and amplification by a high-fidelity polymerase.
 
@@ -32,4 +31,4 @@ class Pool_Bestcase(BaseWorkflow):
         # add optional arguments
         if self.coverage: cmd.extend(['--coverage', str(self.coverage)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
@@ -0,0 +1,39 @@
+import dataclasses
+import pathlib
+
+from .baseworkflow import BaseWorkflow
+from ..tools import SubProcess, WorkerProcess
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+@dataclasses.dataclass
+class SequencingWorkflow(BaseWorkflow):
+    """ Abstract class for workflows whose script simulates paired-end sequencing into the output folder, after which the paired reads are merged and converted into the output file. """
+
+    min_read_length: int = 0    # merged reads shorter than this are dropped
+    drop_n_reads: bool = False  # whether merged reads containing N are dropped
+
+    streams_output = True
+    merge_command_path = str(pathlib.Path(__file__).parent.absolute() / 'bin' / 'tool_ngmerge' / 'merge.sh')
+
+    @property
+    def reads_options(self):
+        """ Returns the options for the conversion of the merged reads. """
+        options = []
+        if self.min_read_length: options.extend(['--min_length', str(self.min_read_length)])
+        if self.drop_n_reads: options.append('--drop_n')
+        return options
+
+
+    def _run_command(self, cmd: list, **kwargs):
+        """ Runs the command of the workflow, or its Python script in a warm worker process if enabled, followed by merging and converting the reads. """
+        if not self.in_process:
+            return SubProcess(cmd + (['--', *self.reads_options] if self.reads_options else []), **kwargs)
+
+        # the script next to the command takes the output folder instead of the output file, the reads are merged by the worker afterwards
+        script = pathlib.Path(cmd[0]).with_name('run.py')
+        output_folder = str(pathlib.Path(cmd[2]).parent)
+        return WorkerProcess([str(script), cmd[1], output_folder, *cmd[3:]], post_command=[self.merge_command_path, output_folder, cmd[2], *self.reads_options], **kwargs)
@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseworkflow import BaseWorkflow
-from ..tools import SubProcess
+from .sequencingworkflow import SequencingWorkflow
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,7 +9,7 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class SerialDilution(BaseWorkflow):
+class SerialDilution(SequencingWorkflow):
     """
     XXX
 
@@ -32,4 +31,4 @@ class SerialDilution(BaseWorkflow):
         # add optional arguments
         if self.n_dilutions: cmd.extend(['--n_dilutions', str(self.n_dilutions)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
@@ -1,8 +1,7 @@
 import dataclasses
 import pathlib
 
-from .baseworkflow import BaseWorkflow
-from ..tools import SubProcess
+from .sequencingworkflow import SequencingWorkflow
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,7 +9,7 @@ logger.setLevel(logging.DEBUG)
 
 
 @dataclasses.dataclass
-class WorstCase(BaseWorkflow):
+class WorstCase(SequencingWorkflow):
     """
     Worst-case workflow assuming synthesis by electrochemical methods and amplification by a Taq-based polymerase.
 
@@ -36,4 +35,4 @@ class WorstCase(BaseWorkflow):
         if self.aging_halflives: cmd.extend(['--aging_halflives', str(self.aging_halflives)])
         if self.sequencing_depth: cmd.extend(['--sequencing_depth', str(self.sequencing_depth)])
 
-        return SubProcess(cmd, **kwargs)
\ No newline at end of file
+        return self._run_command(cmd, **kwargs)
\ No newline at end of file
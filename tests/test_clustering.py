@@ -0,0 +1,94 @@
+import pytest
+import pathlib
+import subprocess
+import sys
+import random
+import dt4dds_benchmark
+
+
+LSH = pathlib.Path(dt4dds_benchmark.clustering.LSH.command_path).with_name('clustering.py')
+CONSENSUS = pathlib.Path(dt4dds_benchmark.clustering.LSH.command_path).parent.parent / 'tool_kalign' / 'cluster2consensus.py'
+
+
+def create_reads(folder, n_sequences=100, length=120, coverage=10, rate_substitutions=0.01):
+    """ Writes shuffled reads with substitutions and returns the design sequences and the index of the design sequence of each read. """
+    rng = random.Random(1)
+    design = [''.join(rng.choice('ACGT') for _ in range(length)) for _ in range(n_sequences)]
+    reads = [(i, ''.join(rng.choice('ACGT') if rng.random() < rate_substitutions else base for base in design[i])) for i in range(n_sequences) for _ in range(coverage)]
+    rng.shuffle(reads)
+    (pathlib.Path(folder) / 'reads.txt').write_text(''.join(read + '\n' for _, read in reads))
+    return design, {read: i for i, read in reads}
+
+
+def mutate(rng, sequence, rate):
+    """ Returns the sequence with substitutions, deletions and insertions, each at the given rate per base. """
+    return ''.join(rng.choice(['', rng.choice('ACGT'), base + rng.choice('ACGT')]) if rng.random() < 3*rate else base for base in sequence)
+
+
+def run_clustering(script, folder, *args):
+    subprocess.run([sys.executable, str(script), str(folder / 'reads.txt'), str(folder / 'clusters.txt'), *args], check=True, capture_output=True)
+    return [line.split(',') for line in (folder / 'clusters.txt').read_text().splitlines()]
+
+
+@pytest.mark.clustering
+@pytest.mark.parametrize("threads", [1, 2])
+def test_lsh(tmp_path, threads):
+    design, origins = create_reads(tmp_path)
+    clusters = run_clustering(LSH, tmp_path, '--threads', str(threads))
+
+    # most design sequences are recovered by a cluster, and clusters only contain reads of the same design sequence
+    assert len({origins[cluster[0]] for cluster in clusters}) >= 0.9 * len(design)
+    assert all(len({origins[read] for read in cluster}) == 1 for cluster in clusters)
+
+
+@pytest.mark.clustering
+@pytest.mark.parametrize("threads", [1, 2])
+def test_consensus(tmp_path, threads):
+    rng = random.Random(1)
+    design = [''.join(rng.choice('ACGT') for _ in range(120)) for _ in range(100)]
+    clusters = [[mutate(rng, sequence, 0.01) for _ in range(10)] for sequence in design]
+    singletons = [design[i % len(design)][i % 7:] for i in range(2500)]
+    (tmp_path / 'clusters.txt').write_text(''.join(','.join(cluster) + '\n' for cluster in clusters + [[s] for s in singletons]))
+    subprocess.run([sys.executable, str(CONSENSUS), str(tmp_path / 'clusters.txt'), str(tmp_path / 'consensus.txt'), '--mode', 'native', '--threads', str(threads)], check=True, capture_output=True)
+    consensus = (tmp_path / 'consensus.txt').read_text().splitlines()
+
+    # one consensus sequence per cluster in order across all chunks, which recovers almost all design sequences despite indels
+    assert consensus[len(clusters):] == singletons
+    assert sum(c == d for c, d in zip(consensus, design)) >= 0.95 * len(design)
+
+
+@pytest.mark.clustering
+def test_consensus_counts(tmp_path):
+    rng = random.Random(2)
+    design = ''.join(rng.choice('ACGT') for _ in range(120))
+    variant = mutate(rng, design, 0.05)
+
+    # identical reads are counted beyond the first MAX_SEQUENCES reads of a cluster
+    (tmp_path / 'clusters.txt').write_text(','.join([variant]*60 + [design]*90) + '\n')
+    subprocess.run([sys.executable, str(CONSENSUS), str(tmp_path / 'clusters.txt'), str(tmp_path / 'consensus.txt'), '--mode', 'native'], check=True, capture_output=True)
+    assert (tmp_path / 'consensus.txt').read_text().splitlines() == [design]
+
+
+@pytest.mark.clustering
+def test_kalign_consensus_counts(monkeypatch):
+    import importlib.util, Bio.Align, Bio.Seq, Bio.SeqRecord
+    spec = importlib.util.spec_from_file_location('cluster2consensus', CONSENSUS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # sequences of equal length align without gaps, kalign only sees each unique sequence once
+    aligned = []
+    def get_msa(sequences):
+        aligned.append(list(sequences))
+        return Bio.Align.MultipleSeqAlignment([Bio.SeqRecord.SeqRecord(Bio.Seq.Seq(s), id=str(i)) for i, s in enumerate(sequences)])
+    monkeypatch.setattr(module, 'get_msa', get_msa)
+    assert module.kalign_consensus([['ACGA']*2 + ['ACGT']*3, ['ACGT']*5]) == ['ACGT', 'ACGT']
+    assert module.kalign_consensus([['ACGA']*3 + ['ACGT']*2]) == ['ACGA']
+    assert aligned == [['ACGT', 'ACGA'], ['ACGA', 'ACGT']]
+
+
+@pytest.mark.clustering
+def test_consensus_options():
+    # kalign stays the default, the native engine is opt-in
+    assert dt4dds_benchmark.clustering.LSH('lsh').consensus_options == []
+    assert dt4dds_benchmark.clustering.LSH('lsh', consensus_mode='native', consensus_threads=2).consensus_options == ['--mode', 'native', '--threads', '2']
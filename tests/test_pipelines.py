@@ -0,0 +1,362 @@
+import pytest
+import dataclasses
+import os
+import pathlib
+import socket
+import subprocess
+import dt4dds_benchmark
+
+
+
+@dataclasses.dataclass
+class CopyClustering(dt4dds_benchmark.clustering.BaseClustering):
+    """ Clustering that only copies the reads, used to run pipelines without external tools. """
+
+    def _run_clustering(self, input_file: pathlib.Path, output_file: pathlib.Path, **kwargs):
+        return dt4dds_benchmark.tools.SubProcess(['cp', str(input_file.resolve()), str(output_file.resolve())], **kwargs)
+
+
+@dataclasses.dataclass
+class FailingClustering(dt4dds_benchmark.clustering.BaseClustering):
+    """ Clustering that always fails with a non-zero return code. """
+
+    def _run_clustering(self, input_file: pathlib.Path, output_file: pathlib.Path, **kwargs):
+        return dt4dds_benchmark.tools.SubProcess(['false'], **kwargs)
+
+
+@dataclasses.dataclass
+class ScratchFullClustering(CopyClustering):
+    """ Clustering that fails as if out of space when working in the given scratch directory, leaving partial outputs behind. Like the actual tools, it refuses to overwrite existing outputs. """
+
+    scratch_dir: str = ''
+
+    def _run_clustering(self, input_file: pathlib.Path, output_file: pathlib.Path, **kwargs):
+        if output_file.is_relative_to(self.scratch_dir):
+            return dt4dds_benchmark.tools.SubProcess(['sh', '-c', 'echo partial > "$1"; echo partial > "$1.tmp"; exit 1', 'sh', str(output_file)], **kwargs)
+        return dt4dds_benchmark.tools.SubProcess(['sh', '-c', '! [ -e "$2" ] && ! [ -e "$2.tmp" ] && cp "$1" "$2"', 'sh', str(input_file), str(output_file)], **kwargs)
+
+
+@dataclasses.dataclass
+class CopyCodec(dt4dds_benchmark.codecs.BaseCodec):
+    """ Codec that only copies the data, used to run pipelines without external tools. """
+
+    def _run_encoding(self, input_file: pathlib.Path, sequence_file: pathlib.Path, **kwargs):
+        return dt4dds_benchmark.tools.SubProcess(['cp', str(input_file.resolve()), str(sequence_file.resolve())], **kwargs)
+
+    def _run_decoding(self, sequence_file: pathlib.Path, output_file: pathlib.Path, **kwargs):
+        return dt4dds_benchmark.tools.SubProcess(['cp', str(sequence_file.resolve()), str(output_file.resolve())], **kwargs)
+
+
+@dataclasses.dataclass
+class CopyWorkflow(dt4dds_benchmark.workflows.BaseWorkflow):
+    """ Workflow that only copies the sequences, used to run pipelines without external tools. """
+
+    def _run_workflow(self, sequence_file: pathlib.Path, output_file: pathlib.Path, **kwargs):
+        return dt4dds_benchmark.tools.SubProcess(['cp', str(sequence_file.resolve()), str(output_file.resolve())], **kwargs)
+
+
+@dataclasses.dataclass
+class StreamingWorkflow(CopyWorkflow):
+    """ Workflow that copies the sequences in a single pass, such that its output can be streamed. """
+
+    streams_output = True
+    fail: bool = False
+
+    def _run_workflow(self, sequence_file: pathlib.Path, output_file: pathlib.Path, **kwargs):
+        if self.fail:
+            return dt4dds_benchmark.tools.SubProcess(['false'], **kwargs)
+        return super()._run_workflow(sequence_file, output_file, **kwargs)
+
+
+def create_pipelines(folder, n_pipelines=4, clustering=None, lazy=False):
+    read_files = []
+    for i in range(n_pipelines):
+        read_file = pathlib.Path(folder) / f"reads_{i}.txt"
+        read_file.write_text("ACGT\n" * (i+1))
+        read_files.append(read_file)
+    return dt4dds_benchmark.pipelines.Clustering.factory(
+        input_files=read_files,
+        clusterings=[clustering or CopyClustering('copy')],
+        lazy=lazy,
+    )
+
+
+
+
+@pytest.mark.pipelines
+@pytest.mark.parametrize("workers", [1, 3])
+def test_manager_ordering(tmp_path, workers):
+    pipelines = create_pipelines(tmp_path)
+    manager = dt4dds_benchmark.pipelines.BaseManager()
+    manager.run(pipelines, workers=workers)
+
+    assert [o['status'] for o in manager.overview] == ['Finished']*len(pipelines)
+    assert [o['input_file'] for o in manager.overview] == [str(p.input_file) for p in pipelines]
+    assert all(r['completed'] for r in manager.results)
+    assert len(manager.performance) == len(pipelines)
+
+
+@pytest.mark.pipelines
+@pytest.mark.parametrize("workers", [1, 2])
+def test_hdf5manager(tmp_path, workers):
+    pipelines = create_pipelines(tmp_path)
+    pipelines.extend(create_pipelines(tmp_path, n_pipelines=1, clustering=FailingClustering('fail')))
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.run(pipelines, workers=workers)
+
+    data = manager.get_data()
+    assert list(data.overview['status']) == ['Finished']*len(pipelines)
+    assert data.results['completed'].sum() == len(pipelines) - 1
+
+
+@pytest.mark.pipelines
+def test_hdf5manager_resume(tmp_path):
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.run(create_pipelines(tmp_path, n_pipelines=3))
+
+    # mark one of the runs as stale, left behind by a process that is gone
+    uids = list(manager.get_data().overview['id'])
+    process = subprocess.Popen(['true'])
+    process.wait()
+    with manager._open() as f:
+        f[uids[0]].attrs['status'] = 'Running'
+        f[uids[0]].attrs['owner'] = f"{socket.gethostname()}:{process.pid}"
+
+    # re-running should only run the stale and the new pipelines
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.run(create_pipelines(tmp_path, n_pipelines=4), resume=True)
+    assert len(manager.overview) == 2
+
+    data = manager.get_data()
+    assert list(data.overview['status']) == ['Finished']*4
+    assert data.overview['key'].nunique() == 4
+
+
+@pytest.mark.pipelines
+def test_hdf5manager_resume_execution_options(tmp_path):
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.run(create_pipelines(tmp_path, n_pipelines=2))
+
+    # options that only change how the pipelines are run do not change their keys
+    pipelines = create_pipelines(tmp_path, n_pipelines=2, clustering=CopyClustering('copy', max_memory_gb=4, cpu_affinity=[0]))
+    for pipeline in pipelines:
+        pipeline.stream_steps, pipeline.scratch_dir = True, ''
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.run(pipelines, resume=True)
+    assert len(manager.overview) == 0
+
+    # unlike the options that change their results
+    keys = {dt4dds_benchmark.pipelines.Clustering(input_file=tmp_path / "reads_0.txt", clustering=dt4dds_benchmark.clustering.LSH('lsh', **kwargs)).key for kwargs in [{}, {'threads': 2, 'consensus_threads': 2}, {'consensus_mode': 'native'}]}
+    assert len(keys) == 2
+
+
+@pytest.mark.pipelines
+@pytest.mark.parametrize("resume", [True, False])
+def test_hdf5manager_keeps_records(tmp_path, resume):
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.run(create_pipelines(tmp_path, n_pipelines=2))
+
+    # a failed run, and the run of another sweep which is still in progress
+    uids = list(manager.get_data().overview['id'])
+    with manager._open() as f:
+        f[uids[0]].attrs['status'] = 'Failed: error'
+        f[uids[1]].attrs['status'] = 'Running'
+        f[uids[1]].attrs['owner'] = f"{socket.gethostname()}:{os.getpid()}"
+
+    # only resuming removes the failed runs, the running one is never removed
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.run(create_pipelines(tmp_path, n_pipelines=2), resume=resume)
+    remaining = set(manager.get_data().overview['id'])
+    assert (uids[0] in remaining) != resume
+    assert uids[1] in remaining
+
+
+@pytest.mark.pipelines
+def test_hdf5manager_replicates(tmp_path):
+    # running the same parameters again adds a replicate, unless resuming
+    for _ in range(2):
+        manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+        manager.run(create_pipelines(tmp_path, n_pipelines=1))
+    data = manager.get_data()
+    assert list(data.overview['status']) == ['Finished']*2 and data.overview['key'].nunique() == 1
+    assert len(data.results) == 2
+
+
+@pytest.mark.pipelines
+def test_hdf5writer_failures(tmp_path):
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    writer = dt4dds_benchmark.pipelines.manager.HDF5Writer(manager, flush_interval=0)
+    performance = [{'identifier': 'step', 'time': 1.0}]
+
+    # an update which cannot be written is dropped instead of blocking the following updates
+    writer.pending = [('update', 'a', {'status': 'Finished'}, {'value': object()}, None), ('update', 'b', {'status': 'Finished'}, {'value': 1}, performance)]
+    writer._flush()
+    assert len(writer.dropped) == 1 and not writer.pending
+
+    # writing the same updates again, e.g. after an I/O error during the batch, overwrites them
+    writer.pending = [('update', 'b', {'status': 'Finished'}, {'value': 2}, performance)]
+    writer._flush()
+    statuses = {uid: status for uid, key, status, owner in manager._get_statuses()}
+    assert statuses['a'].startswith('Failed') and statuses['b'] == 'Finished'
+    assert list(manager.get_data().results.set_index('id')['value'].dropna()) == [2]
+
+
+@pytest.mark.pipelines
+@pytest.mark.parametrize("workers", [1, 2])
+def test_lazy_factory(tmp_path, workers):
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.INITIATE_BATCH_SIZE = 2
+
+    # record how many pipelines have finished whenever a new pipeline is created
+    n_finished = []
+    def pipelines():
+        for pipeline in create_pipelines(tmp_path, n_pipelines=6, lazy=True):
+            n_finished.append(len(manager.overview))
+            yield pipeline
+    manager.run(pipelines(), workers=workers)
+    assert n_finished[-1] > 0
+
+    data = manager.get_data()
+    assert list(data.overview['status']) == ['Finished']*6
+
+    # resuming with a new generator only runs the new pipelines
+    manager = dt4dds_benchmark.pipelines.HDF5Manager(tmp_path / "data.hdf5")
+    manager.run(create_pipelines(tmp_path, n_pipelines=7, lazy=True), workers=workers, resume=True)
+    assert len(manager.overview) == 1
+
+
+@pytest.mark.pipelines
+def test_step_cache(tmp_path):
+    input_file = tmp_path / "input"
+    input_file.write_text("ACGT\n" * 10)
+    pipelines = dt4dds_benchmark.pipelines.Full.factory(
+        input_files=[input_file],
+        codecs=[CopyCodec('copy')],
+        workflows=[CopyWorkflow('copy')],
+        clusterings=[CopyClustering('a'), CopyClustering('b')],
+        cache_folder=tmp_path / "cache",
+        cache_steps=['encoding', 'workflow'],
+    )
+
+    performances = []
+    for pipeline in pipelines:
+        result, performance = pipeline.run()
+        assert result['decoding_success']
+        performances.append({p['identifier']: p['cached'] for p in performance})
+    assert performances[0] == {'encoding': False, 'workflow': False, 'clustering': False, 'decoding': False}
+    assert performances[1] == {'encoding': True, 'workflow': True, 'clustering': False, 'decoding': False}
+
+
+@pytest.mark.pipelines
+def test_shared_prefix(tmp_path):
+    input_file = tmp_path / "input"
+    input_file.write_text("ACGT\n" * 10)
+    pipelines = dt4dds_benchmark.pipelines.Full.factory(
+        input_files=[input_file],
+        codecs=[CopyCodec('copy')],
+        workflows=[CopyWorkflow('a'), CopyWorkflow('b')],
+        clusterings=[CopyClustering('a'), CopyClustering('b'), CopyClustering('c')],
+        cache_folder=tmp_path / "cache",
+        cache_steps=['encoding', 'workflow'],
+        compare_by_digest=True,
+    )
+    assert len({pipeline.prefix_key for pipeline in pipelines}) == 2
+
+    manager = dt4dds_benchmark.pipelines.BaseManager()
+    manager.run(pipelines, workers=3)
+    n_workflows = sum(not p['cached'] for performance in manager.performance for p in performance if p['identifier'] == 'workflow')
+    n_encodings = sum(not p['cached'] for performance in manager.performance for p in performance if p['identifier'] == 'encoding')
+    assert n_workflows == 2
+    assert n_encodings <= 2
+    assert all(result['decoding_success'] for result in manager.results)
+
+    # pipelines waiting for their leader do not drain a lazy factory
+    n_finished = []
+    def lazy_pipelines():
+        for pipeline in dt4dds_benchmark.pipelines.Full.factory(
+            input_files=[input_file],
+            codecs=[CopyCodec('copy')],
+            workflows=[CopyWorkflow('a')],
+            clusterings=[CopyClustering(str(i)) for i in range(8)],
+            cache_folder=tmp_path / "cache_lazy",
+            cache_steps=['encoding', 'workflow'],
+            lazy=True,
+        ):
+            n_finished.append(len(manager.overview))
+            yield pipeline
+    manager = dt4dds_benchmark.pipelines.BaseManager()
+    manager.run(lazy_pipelines(), workers=2)
+    assert len(manager.results) == 8
+    assert n_finished[4] > 0
+
+
+@pytest.mark.pipelines
+@pytest.mark.parametrize("workflow, clustering, failed_at", [
+    (StreamingWorkflow('stream'), CopyClustering('copy'), ''),
+    (StreamingWorkflow('stream', fail=True), CopyClustering('copy'), 'workflow'),
+    (StreamingWorkflow('stream'), FailingClustering('fail'), 'clustering'),
+])
+def test_stream_steps(tmp_path, workflow, clustering, failed_at):
+    input_file = tmp_path / "input"
+    input_file.write_text("ACGT\n" * 100000)
+    pipeline = dt4dds_benchmark.pipelines.Full(
+        input_file=input_file,
+        codec=CopyCodec('copy'),
+        workflow=workflow,
+        clustering=clustering,
+        output_folder=tmp_path / "output",
+        stream_steps=True,
+    )
+    assert [len(stage) for stage in pipeline._stages] == [1, 2, 1]
+
+    # failing steps must not leave their partner waiting for the named pipe
+    result, performance = pipeline.run()
+    assert result['failed_at'] == failed_at
+    assert result['decoding_success'] == (not failed_at)
+    assert [p['identifier'] for p in performance][:3] == ['encoding', 'workflow', 'clustering']
+    assert not pipeline.filepath_reads.exists()
+
+
+@pytest.mark.pipelines
+@pytest.mark.parametrize("scratch", [True, False])
+def test_scratch_dir(tmp_path, scratch):
+    scratch_dir = tmp_path / "scratch"
+    scratch_dir.mkdir()
+    pipeline = create_pipelines(tmp_path, n_pipelines=1)[0]
+    pipeline.output_folder = tmp_path / "output"
+    pipeline.scratch_dir = scratch_dir if scratch else ''
+    result, performance = pipeline.run()
+    assert result['completed']
+
+    # only the logs, settings and the output of the last step are copied back from the scratch directory
+    filenames = {filepath.name for filepath in pipeline.output_folder.iterdir()}
+    assert {'pipeline.log', 'clustering.log', 'clustering_settings.yaml', 'clusters.txt'} <= filenames
+    assert ('reads.txt' in filenames) != scratch
+    assert not any(scratch_dir.iterdir())
+
+
+@pytest.mark.pipelines
+def test_scratch_full(tmp_path, monkeypatch):
+    scratch_dir = tmp_path / "scratch"
+    scratch_dir.mkdir()
+    disk_usage = dt4dds_benchmark.pipelines.basepipeline.shutil.disk_usage
+    monkeypatch.setattr(dt4dds_benchmark.pipelines.basepipeline.shutil, 'disk_usage', lambda path: disk_usage(path)._replace(free=0) if pathlib.Path(path).is_relative_to(scratch_dir) else disk_usage(path))
+
+    # the failed step is run again in a working folder on disk
+    pipeline = create_pipelines(tmp_path, n_pipelines=1, clustering=ScratchFullClustering('full', scratch_dir=str(scratch_dir)))[0]
+    pipeline.output_folder = tmp_path / "output"
+    pipeline.scratch_dir = scratch_dir
+    result, performance = pipeline.run()
+    assert result['completed']
+    assert [p['identifier'] for p in performance] == ['clustering']
+    assert 'ran out of space' in (pipeline.output_folder / 'pipeline.log').read_text()
+    assert {filepath.name for filepath in pipeline.output_folder.iterdir()} == {'pipeline.log', 'clustering.log', 'clustering_settings.yaml', 'clusters.txt'}
+    assert not any(scratch_dir.iterdir())
+
+    # the default scratch directory reserves free space for each pipeline working in it
+    monkeypatch.setattr(dt4dds_benchmark.pipelines.basepipeline, 'DEFAULT_SCRATCH_DIR', scratch_dir)
+    monkeypatch.setattr(dt4dds_benchmark.pipelines.basepipeline.shutil, 'disk_usage', lambda path: disk_usage(path)._replace(free=3e9))
+    pipeline.scratch_dir = None
+    assert pipeline._scratch_dir == scratch_dir
+    (scratch_dir / f"{dt4dds_benchmark.pipelines.basepipeline.SCRATCH_PREFIX}running").mkdir()
+    assert pipeline._scratch_dir is None
@@ -0,0 +1,125 @@
+import pytest
+import time
+import dt4dds_benchmark
+
+
+
+@pytest.mark.tools
+def test_subprocess_completion():
+    start = time.time()
+    process = dt4dds_benchmark.tools.SubProcess(['true'])
+    assert process.metadata['return_code'] == 0
+    assert time.time() - start < 0.5
+
+
+@pytest.mark.tools
+def test_subprocess_timeout():
+    process = dt4dds_benchmark.tools.SubProcess(['sleep', '10'], timeout=0.5)
+    assert process.metadata['return_code'] != 0
+    assert process.metadata['duration'] < 5
+
+
+@pytest.mark.tools
+def test_subprocess_accounting():
+    process = dt4dds_benchmark.tools.SubProcess(['bash', '-c', 'python -c "x = bytearray(200*1024*1024); sum(range(10**7))"'], monitor_interval=0.05)
+    metadata = process.metadata
+    assert metadata['memory_peak_uss'] > 0.15
+    assert metadata['memory_peak_rss'] >= metadata['memory_peak_uss']
+    assert metadata['cpu_user_time'] + metadata['cpu_system_time'] > 0.1
+    assert metadata['n_child_processes'] >= 0
+
+
+@pytest.mark.tools
+def test_subprocess_limits(tmp_path):
+    process = dt4dds_benchmark.tools.SubProcess(['python', '-c', 'while True: pass'], max_cpu_seconds=1, timeout=30)
+    assert process.metadata['return_code'] != 0
+    assert process.metadata['killed_reason'] == 'cpu_time'
+
+    process = dt4dds_benchmark.tools.SubProcess(['bash', '-c', 'python -c "import time; x = bytearray(500*1024*1024); time.sleep(5)"'], max_memory_gb=0.2, monitor_interval=0.05, timeout=30)
+    assert process.metadata['return_code'] != 0
+    assert process.metadata['killed_reason'] == 'memory'
+
+    process = dt4dds_benchmark.tools.SubProcess(['python', '-c', 'import os; assert os.sched_getaffinity(0) == {0}'], cpu_affinity=[0])
+    assert process.metadata['return_code'] == 0
+    assert process.metadata['killed_reason'] == ''
+
+    # the limits already apply when the command starts, also in the warm workers
+    check = 'import resource; assert resource.getrlimit(resource.RLIMIT_DATA)[0] == 2**30 and resource.getrlimit(resource.RLIMIT_CPU)[0] == 10'
+    assert dt4dds_benchmark.tools.SubProcess(['python', '-c', check], max_memory_gb=1, max_cpu_seconds=10).metadata['return_code'] == 0
+    script = tmp_path / 'script.py'
+    script.write_text(f'def parse(args):\n    {check}\n')
+    assert dt4dds_benchmark.tools.WorkerProcess([script], max_memory_gb=1, max_cpu_seconds=10).metadata['return_code'] == 0
+
+
+@pytest.mark.tools
+@pytest.mark.parametrize("use_digest", [False, True])
+def test_compare_files(tmp_path, use_digest):
+    original = tmp_path / 'original.bin'
+    original.write_bytes(bytes(range(256)) * 10000)
+    cases = {
+        'equal': (original.read_bytes(), True),
+        'longer': (original.read_bytes() + b'padding', True),
+        'shorter': (original.read_bytes()[:-1], False),
+        'different': (original.read_bytes()[:1500000] + b'x' + original.read_bytes()[1500001:], False),
+    }
+    for name, (contents, expected) in cases.items():
+        (tmp_path / name).write_bytes(contents)
+        assert dt4dds_benchmark.tools.files_are_equal(original, tmp_path / name, use_digest=use_digest) == expected
+
+
+@pytest.mark.tools
+def test_compare_archives(tmp_path):
+    import tarfile
+
+    def create_archive(path, files):
+        with tarfile.open(path, 'w:gz') as tar:
+            for name, contents in files.items():
+                (tmp_path / 'file').write_bytes(contents)
+                tar.add(tmp_path / 'file', arcname=name)
+        return path
+
+    files = {'a.txt': b'a'*100000, 'folder/b.txt': b'b'*100}
+    original = create_archive(tmp_path / 'original.tar.gz', files)
+    cases = {
+        'reordered': ({name: files[name] for name in reversed(files)}, True),
+        'longer': ({**files, 'a.txt': b'a'*100001, 'c.txt': b'c'}, True),
+        'missing': ({'a.txt': b'a'*100000}, False),
+        'different': ({**files, 'folder/b.txt': b'b'*99 + b'x'}, False),
+    }
+    for name, (contents, expected) in cases.items():
+        compare = create_archive(tmp_path / f'{name}.tar.gz', contents)
+        assert dt4dds_benchmark.tools.file_compare.compare_archives(original, compare) == expected
+    assert dt4dds_benchmark.tools.files_are_equal(original, tmp_path / 'reordered.tar.gz')
+
+
+@pytest.mark.tools
+def test_step_cache(tmp_path):
+    cache = dt4dds_benchmark.tools.StepCache(tmp_path / 'cache')
+    (tmp_path / 'output.txt').write_text('ACGT\n')
+
+    # metadata which is not JSON-serializable is stored as string, without leaving temporary entries behind
+    cache.store('abcd', tmp_path, ['output.txt'], {'value': object()})
+    assert [entry.name for entry in (tmp_path / 'cache').iterdir()] == ['ab']
+
+    # changing an output in place does not change the cache entry, nor its copies in other folders
+    (tmp_path / 'output.txt').write_text('TTTT\n')
+    (tmp_path / 'loaded').mkdir()
+    assert isinstance(cache.load('abcd', tmp_path / 'loaded')['value'], str)
+    assert (tmp_path / 'loaded' / 'output.txt').read_text() == 'ACGT\n'
+
+
+@pytest.mark.tools
+def test_workerprocess(tmp_path):
+    script = tmp_path / 'script.py'
+    script.write_text('import os, sys, time\ndef parse(args):\n    print(os.getppid())\n    time.sleep(float(args[0]))\n    sys.exit(int(args[1]) if args[1].isdigit() else None)\n')
+
+    processes = [dt4dds_benchmark.tools.WorkerProcess([script, '0', str(i)], process_log_file=tmp_path / f'log_{i}.txt') for i in range(2)]
+    assert [process.metadata['return_code'] for process in processes] == [0, 1]
+    assert (tmp_path / 'log_0.txt').read_text() == (tmp_path / 'log_1.txt').read_text()
+
+    process = dt4dds_benchmark.tools.WorkerProcess([script, '10', '0'], timeout=0.5)
+    assert process.metadata['return_code'] != 0
+    assert process.metadata['killed_reason'] == 'timeout'
+    assert dt4dds_benchmark.tools.WorkerProcess([script, '0', '0'], process_log_file=tmp_path / 'log_2.txt').metadata['return_code'] == 0
+    assert (tmp_path / 'log_2.txt').read_text() == (tmp_path / 'log_0.txt').read_text()
+    assert dt4dds_benchmark.tools.WorkerProcess([script, '0', 'none']).metadata['return_code'] == 0
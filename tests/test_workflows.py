@@ -0,0 +1,123 @@
+import pytest
+import pathlib
+import subprocess
+import sys
+import random
+import dt4dds_benchmark
+
+
+ERRORGENERATOR = pathlib.Path(dt4dds_benchmark.workflows.ErrorGenerator.command_path).with_name('run.py')
+
+
+def create_design(folder, n_sequences=200, length=120):
+    rng = random.Random(1)
+    design = pathlib.Path(folder) / 'design.txt'
+    design.write_text(''.join(''.join(rng.choice('ACGT') for _ in range(length)) + '\n' for _ in range(n_sequences)))
+    return design
+
+
+def run_errorgenerator(design, reads, *args, script=ERRORGENERATOR):
+    subprocess.run([sys.executable, str(script), str(design), str(reads), *args], check=True, capture_output=True)
+    return reads.read_text().splitlines()
+
+
+@pytest.mark.workflows
+def test_errorgenerator_substitutions(tmp_path):
+    design = create_design(tmp_path)
+    reads = run_errorgenerator(design, tmp_path / 'reads.txt', '--rate_substitutions', '0.05', '--coverage', '10')
+    sequences = [sequence for sequence in design.read_text().splitlines() for _ in range(10)]
+
+    assert len(reads) == len(sequences)
+    assert all(len(read) == len(sequence) for read, sequence in zip(reads, sequences))
+    n_substitutions = sum(a != b for read, sequence in zip(reads, sequences) for a, b in zip(read, sequence))
+    assert n_substitutions / sum(map(len, sequences)) == pytest.approx(0.05, abs=0.005)
+
+
+@pytest.mark.workflows
+def test_errorgenerator_indels(tmp_path):
+    design = create_design(tmp_path)
+    reads = run_errorgenerator(design, tmp_path / 'reads.txt', '--rate_deletions', '0.05', '--rate_insertions', '0.02', '--coverage', '10', '--dropout', '0.5')
+
+    assert 500 < len(reads) < 1500 and len(reads) % 10 == 0
+    assert sum(map(len, reads)) / len(reads) == pytest.approx(120 * 0.95 * 1.02, abs=0.5)
+    assert set(''.join(reads)) <= set('ACGT')
+
+
+@pytest.mark.workflows
+def test_errorgenerator_seeding(tmp_path):
+    design = create_design(tmp_path, n_sequences=2000)
+    args = ['--rate_substitutions', '0.05', '--rate_deletions', '0.02', '--rate_insertions', '0.01', '--coverage', '20', '--dropout', '0.1']
+    reads = run_errorgenerator(design, tmp_path / 'reads_1.txt', *args, '--seed', '42')
+    assert run_errorgenerator(design, tmp_path / 'reads_2.txt', *args, '--seed', '42', '--threads', '3') == reads
+    assert run_errorgenerator(design, tmp_path / 'reads_3.txt', *args, '--seed', '43') != reads
+
+
+@pytest.mark.workflows
+def test_errorgenerator_motifs(tmp_path):
+    script = pathlib.Path(dt4dds_benchmark.workflows.ErrorGeneratorMotifs.command_path).with_name('run.py')
+    motifs = set(line.strip() for line in script.with_name('undesired_sequences.fasta').read_text().splitlines() if not line.startswith('>'))
+    design = create_design(tmp_path)
+    sequences = design.read_text().splitlines()
+    sequences = sequences[:100] + [sequence[:50] + 'TATAAA' + sequence[56:] for sequence in sequences[100:]]
+    design.write_text('\n'.join(sequences) + '\n')
+
+    # all sequences with motifs are dropped, all others are kept
+    reads = run_errorgenerator(design, tmp_path / 'reads.txt', '--coverage', '2', '--dropout_motif', '1', script=script)
+    assert reads == [sequence for sequence in sequences if not any(motif in sequence for motif in motifs) for _ in range(2)]
+
+
+@pytest.mark.workflows
+def test_errorgenerator_in_process(tmp_path):
+    design = create_design(tmp_path)
+    workflow = dt4dds_benchmark.workflows.ErrorGenerator(rate_substitutions=0.01, coverage=5, seed=1, in_process=True)
+    metadata = [workflow.run(design, tmp_path / f'reads_{i}.txt', process_log_file=tmp_path / f'log_{i}.txt') for i in range(2)]
+    assert all(m['return_code'] == 0 for m in metadata)
+    expected = run_errorgenerator(design, tmp_path / 'reads.txt', '--rate_substitutions', '0.01', '--coverage', '5', '--seed', '1')
+    assert (tmp_path / 'reads_0.txt').read_text().splitlines() == (tmp_path / 'reads_1.txt').read_text().splitlines() == expected
+    assert 'Added 200' in (tmp_path / 'log_1.txt').read_text()
+    assert set(metadata[0]) == set(dt4dds_benchmark.tools.SubProcess(['true']).metadata)
+
+    # scripts using a pool of processes can pickle their own functions
+    workflow = dt4dds_benchmark.workflows.ErrorGenerator(rate_substitutions=0.01, coverage=5, seed=1, in_process=True, threads=2)
+    assert workflow.run(design, tmp_path / 'reads_threads.txt', process_log_file=tmp_path / 'log_threads.txt')['return_code'] == 0
+    assert (tmp_path / 'reads_threads.txt').read_text().splitlines() == expected
+
+
+@pytest.mark.workflows
+@pytest.mark.parametrize("stage", ['synthesis', 'pcr'])
+def test_bestcase_checkpoint(tmp_path, stage):
+    script = pathlib.Path(dt4dds_benchmark.workflows.BestCase.command_path).with_name('run.py')
+    design = create_design(tmp_path, n_sequences=50)
+    args = ['--sequencing_depth', '10', '--checkpoint_folder', str(tmp_path / 'checkpoints'), '--checkpoint_stage', stage]
+
+    logs = []
+    for i, coverage in enumerate(['10', '20']):
+        process = subprocess.run([sys.executable, str(script), str(design), str(tmp_path / f'run_{i}'), '--initial_coverage', coverage, *args], check=True, capture_output=True, text=True)
+        logs.append(process.stdout + process.stderr)
+        assert (tmp_path / f'run_{i}' / 'R1.fq.gz').exists()
+
+    assert len(list((tmp_path / 'checkpoints').iterdir())) == 1
+    assert 'Loaded pool from checkpoint' not in logs[0] and 'Loaded pool from checkpoint' in logs[1]
+    assert 'Finished synthesis' not in logs[1]
+    assert ('Finished PCR 1' in logs[1]) == (stage == 'synthesis')
+
+
+@pytest.mark.workflows
+@pytest.mark.parametrize("options, expected", [
+    ([], ['ACGTACGT', 'ACGNACGT', 'ACG']),
+    (['--min_length', '5'], ['ACGTACGT', 'ACGNACGT']),
+    (['--min_length', '5', '--drop_n'], ['ACGTACGT']),
+])
+def test_fastq_to_reads(tmp_path, options, expected):
+    import gzip
+    script = pathlib.Path(dt4dds_benchmark.workflows.SequencingWorkflow.merge_command_path).with_name('to_reads.py')
+    with gzip.open(tmp_path / 'merged.fq.gz', 'wt') as f:
+        for i, sequence in enumerate(['ACGTACGT', 'ACGNACGT', 'ACG']):
+            f.write(f"@read{i}\n{sequence}\n+\n{'I'*len(sequence)}\n")
+
+    subprocess.run([sys.executable, str(script), str(tmp_path / 'merged.fq.gz'), str(tmp_path / 'reads.txt'), *options], check=True)
+    assert (tmp_path / 'reads.txt').read_text().splitlines() == expected
+
+    # NGmerge pipes its uncompressed output into stdin
+    subprocess.run([sys.executable, str(script), '-', str(tmp_path / 'piped.txt'), *options], input=gzip.decompress((tmp_path / 'merged.fq.gz').read_bytes()), check=True)
+    assert (tmp_path / 'piped.txt').read_text().splitlines() == expected